@@ -0,0 +1,62 @@
+#This script crawls the items of all open projects concurrently, pages of one project are still fetched in cursor order.
+import os
+import asyncio
+import logging
+import github_utils
+
+# Maximum number of item pages fetched at the same time for one organization
+CRAWL_CONCURRENCY = int(os.environ.get('CRAWL_CONCURRENCY', 4))
+
+# With on_page, each page is handed to on_page(project_number, items) as soon as it arrives and nothing is kept
+# A project whose page could not be fetched is added to failed, its items are then incomplete
+async def fetch_project_items_async(project_number: int, org_name: str, github_token: str, semaphore: asyncio.Semaphore, on_page=None,
+                                    needs: frozenset = github_utils.ALL_NEEDS, schema=None, failed: set = None) -> list:
+    all_items = []
+    after_cursor = None
+    item_count = 0
+
+    while True:
+        # The request runs on the shared pooled HTTP client in a worker thread, so retries and keep-alive still apply
+        async with semaphore:
+            page = await asyncio.to_thread(github_utils.fetch_project_items_page, project_number, after_cursor, org_name, github_token, needs, schema)
+        if page is None:
+            logging.error(f"Crawl of project {project_number} stopped after {item_count} items")
+            if failed is not None:
+                failed.add(project_number)
+            return all_items
+
+        project_items, page_info = page
+        item_count += len(project_items)
+        if on_page:
+            on_page(project_number, project_items)
+        else:
+            all_items.extend(project_items)
+
+        if not page_info['hasNextPage']:
+            break
+
+        after_cursor = page_info['endCursor']
+
+    logging.debug("Fetched %d items of project %s", item_count, project_number)
+    return all_items
+
+# needs is the set of item parts the rules read, schemas maps project numbers to their field schemas
+# and the numbers of the projects that were not crawled to the end are added to failed
+async def crawl_projects_async(project_numbers: list, org_name: str, github_token: str, concurrency: int = CRAWL_CONCURRENCY, on_page=None,
+                               needs: frozenset = github_utils.ALL_NEEDS, schemas: dict = None, failed: set = None) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    schemas = schemas or {}
+    results = await asyncio.gather(*[
+        fetch_project_items_async(project_number, org_name, github_token, semaphore, on_page, needs, schemas.get(project_number), failed)
+        for project_number in project_numbers
+    ])
+    return dict(zip(project_numbers, results))
+
+# Returns the items of every project keyed by project number, the lists are empty when on_page is given
+def crawl_projects(project_numbers: list, org_name: str, github_token: str, concurrency: int = CRAWL_CONCURRENCY, on_page=None,
+                   needs: frozenset = github_utils.ALL_NEEDS, schemas: dict = None, failed: set = None) -> dict:
+    return asyncio.run(crawl_projects_async(project_numbers, org_name, github_token, concurrency, on_page, needs, schemas, failed))
+
+# Same signature as github_utils.fetch_all_project_items
+def fetch_all_project_items(project_number: int, org_name: str, github_token: str) -> list:
+    return crawl_projects([project_number], org_name, github_token)[project_number]
@@ -0,0 +1,285 @@
+#This script runs every due date job against generated organizations of growing size through a counting fake transport and checks that the number of API calls stays within the budget of the job.
+import os
+import sys
+import math
+import json
+import random
+import argparse
+import tempfile
+import datetime
+import logging
+import collections
+
+# github_utils logs DEBUG to a file once it is imported, the generated runs would write tens of thousands of lines
+logging.basicConfig(level=logging.WARNING, format="%(levelname)s:%(message)s")
+
+# The jobs run against the fake only, with their own caches
+os.environ['DUE_DATES_CACHE_DIR'] = tempfile.mkdtemp(prefix='due_dates_budget_')
+os.environ.pop('HTTP_CASSETTE_MODE', None)
+for name in ('GITHUB_TOKEN', 'SLACK_BOT_TOKEN', 'AUTH_TOKEN'):
+    os.environ.setdefault(name, 'budget-check')
+os.environ.setdefault('ORG_NAME', 'budget-org')
+
+import requests
+import http_client
+import queries
+import github_utils
+import id_cache
+import field_schema
+import metrics
+import notification_ledger
+import user_directory
+import slack_digest
+import label_afterdues
+import rule_engine
+import run_all
+import daemon
+
+TODAY = datetime.date.today()
+# Organizations the jobs are run against, as (open projects, items per project)
+SIZES = [(2, 50), (5, 400), (10, 2000)]
+
+FIELDS = [
+    {'id': 'F_title', 'name': 'Title', 'dataType': 'TITLE'},
+    {'id': 'F_due', 'name': 'Due Date', 'dataType': 'DATE'},
+    {'id': 'F_status', 'name': 'Status', 'dataType': 'SINGLE_SELECT',
+     'options': [{'id': 'O_todo', 'name': 'Todo'}, {'id': 'O_done', 'name': 'Done ✅'}]},
+    {'id': 'F_domain', 'name': 'Domain', 'dataType': 'SINGLE_SELECT', 'options': [{'id': 'O_web', 'name': 'Web'}]}
+]
+
+def make_response(data, status: int = 200) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(data).encode()
+    response.encoding = 'utf-8'
+    response.raw = None
+    return response
+
+def status_event(value: str, day: datetime.date) -> dict:
+    return {'__typename': 'ProjectV2ItemFieldValueChangedEvent', 'field': {'name': 'Status'}, 'value': value,
+            'createdAt': f"{day.isoformat()}T12:00:00Z"}
+
+class GeneratedOrg:
+    def __init__(self, project_count: int, items_per_project: int, repos: int = 6, users: int = 8, seed: int = 0):
+        rng = random.Random(seed)
+        self.project_count = project_count
+        self.repos = repos
+        self.users = users
+        self.projects = []
+        self.items = {}
+        self.timelines = {}
+        # Issues whose Done transition is not in the last page of their timeline
+        self.overflowing = set()
+
+        # A few closed projects, the catalog must filter them out
+        for number in range(1, project_count + project_count // 5 + 1):
+            self.projects.append({
+                'id': f"P_{number}", 'title': f"Project {number}", 'number': number, 'closed': number > project_count,
+                'updatedAt': '2026-01-01T00:00:00Z', 'items': {'totalCount': items_per_project}, 'fields': {'nodes': FIELDS}
+            })
+            self.items[number] = [self.make_item(rng, number, i) for i in range(items_per_project)]
+
+        self.catalog_pages = max(1, math.ceil(project_count / 100))
+        self.item_pages = project_count * max(1, math.ceil(items_per_project / 100))
+
+    def make_item(self, rng: random.Random, number: int, i: int) -> dict:
+        issue_id = f"I_{number}_{i}"
+        due_date = rng.choice([None, TODAY - datetime.timedelta(days=rng.randint(1, 60)), TODAY + datetime.timedelta(days=rng.randint(1, 60))])
+        status = rng.choice([None, 'O_todo', 'O_done'])
+        labels = [name for name, chance in (('Past Due', 0.2), (f"Project {number}", 0.5), ('Backlog', 0.05)) if rng.random() < chance]
+
+        field_values = {}
+        if due_date:
+            field_values['dueDate'] = {'date': due_date.isoformat(), 'field': {'id': 'F_due', 'name': 'Due Date'}}
+        if status:
+            field_values['status'] = {'name': 'Done ✅' if status == 'O_done' else 'Todo', 'optionId': status,
+                                      'field': {'id': 'F_status', 'name': 'Status'}}
+        if rng.random() < 0.7:
+            field_values['domain'] = {'name': 'Web', 'optionId': 'O_web', 'field': {'id': 'F_domain', 'name': 'Domain'}}
+
+        if status == 'O_done' and due_date:
+            self.timelines[issue_id] = [status_event('Done', due_date + datetime.timedelta(days=rng.randint(-5, 5)))]
+            if rng.random() < 0.05:
+                self.overflowing.add(issue_id)
+
+        repo = f"repo{i % self.repos}"
+        return {
+            'id': f"PVTI_{number}_{i}",
+            'updatedAt': '2026-01-01T00:00:00Z',
+            'content': {
+                'id': issue_id, 'updatedAt': '2026-01-01T00:00:00Z', 'title': f"Issue {i}", 'number': i,
+                'repository': {'id': f"R_{repo}", 'nameWithOwner': f"budget-org/{repo}"},
+                'author': {'login': f"user{i % self.users}", 'id': f"U_{i % self.users}"},
+                'labels': {'nodes': [{'name': name} for name in labels]}
+            },
+            'field_values': field_values
+        }
+
+    # Shape an item like the GraphQL response to the given document
+    @staticmethod
+    def project_item(item: dict, text: str) -> dict:
+        content = dict(item['content'])
+        if 'labels(' not in text:
+            content.pop('labels')
+        if 'author{' not in text:
+            content.pop('author')
+        node = {'id': item['id'], 'updatedAt': item['updatedAt'], 'content': content}
+        if 'fieldValues(' in text:
+            node['fieldValues'] = {'nodes': list(item['field_values'].values())}
+        for alias, value in item['field_values'].items():
+            if f"{alias}:fieldValueByName" in text:
+                node[alias] = value
+        return node
+
+class CountingTransport:
+    # Answers the calls of the scripts from a GeneratedOrg and counts them by registered query name
+    def __init__(self, org: GeneratedOrg):
+        self.org = org
+        self.calls = collections.Counter()
+        self.labeled_issues = 0
+        self.timeline_issues = 0
+        self.recipients = set()
+        self.findings = 0
+        self.names = {}
+
+    def query_name(self, text: str) -> str:
+        if text not in self.names:
+            self.names = {query.text: name for name, query in queries.registry.items()}
+        return self.names.get(text, 'unregistered')
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        if 'slack.com' in url:
+            self.calls['slack_post_message'] += 1
+            payload = json.loads(kwargs['data'])
+            self.recipients.add(payload['channel'])
+            self.findings += sum(1 for block in payload['blocks'] if block.get('text', {}).get('text', '').startswith('•'))
+            return make_response({'ok': True})
+        if 'listusers' in url:
+            self.calls['otsimo_listusers'] += 1
+            return make_response({'users': [{'githubName': f"user{i}", 'slackUserId': f"S{i}"} for i in range(self.org.users)]})
+
+        body = json.loads(kwargs['data'])
+        name = self.query_name(body.get('query', '')).split(':')[0]
+        self.calls[name] += 1
+        handler = getattr(self, 'answer_' + name, None)
+        if handler is None:
+            raise AssertionError(f"The budget check has no answer for the query {name}")
+        return make_response({'data': handler(body.get('variables') or {}, body['query'])})
+
+    def answer_project_catalog(self, variables: dict, text: str) -> dict:
+        projects = [project for project in self.org.projects if not (variables.get('search') == 'is:open' and project['closed'])]
+        start = int(variables.get('after') or 0)
+        return {'organization': {'projectsV2': {
+            'pageInfo': {'hasNextPage': start + 100 < len(projects), 'endCursor': str(start + 100)},
+            'nodes': projects[start:start + 100]
+        }}}
+
+    def answer_project_items(self, variables: dict, text: str) -> dict:
+        items = self.org.items[variables['number']]
+        start = int(variables.get('after') or 0)
+        return {'organization': {'projectV2': {'id': f"P_{variables['number']}", 'title': '', 'items': {
+            'pageInfo': {'hasNextPage': start + 100 < len(items), 'endCursor': str(start + 100)},
+            'nodes': [self.org.project_item(item, text) for item in items[start:start + 100]]
+        }}}}
+
+    # Only Past Due exists in the repositories, every other label is created on first use
+    def answer_label_id(self, variables: dict, text: str) -> dict:
+        label = {'id': f"L_{variables['repo']}_{variables['name']}"} if variables['name'] == 'Past Due' else None
+        return {'organization': {'repository': {'label': label}}}
+
+    def answer_create_label(self, variables: dict, text: str) -> dict:
+        return {'createLabel': {'label': {'id': f"L_{variables['repositoryId']}_{variables['name']}", 'name': variables['name']}}}
+
+    def answer_label_changes(self, variables: dict, text: str) -> dict:
+        self.labeled_issues += sum(1 for name in variables if name.startswith('issue'))
+        return {name.replace('issue', 'add'): {'clientMutationId': None} for name in variables if name.startswith('issue')}
+
+    def timeline(self, issue_id: str, first_page: bool) -> dict:
+        overflowing = issue_id in self.org.overflowing and first_page
+        return {'id': issue_id, 'timelineItems': {
+            'pageInfo': {'hasPreviousPage': overflowing, 'startCursor': 'older' if overflowing else None},
+            'nodes': [] if overflowing else self.org.timelines.get(issue_id, [])
+        }}
+
+    def answer_issue_timelines(self, variables: dict, text: str) -> dict:
+        self.timeline_issues += len(variables['ids'])
+        return {'nodes': [self.timeline(issue_id, True) for issue_id in variables['ids']]}
+
+    def answer_issue_timeline(self, variables: dict, text: str) -> dict:
+        return {'node': self.timeline(variables['id'], False)}
+
+def batches(count: int, batch_size: int) -> int:
+    return math.ceil(count / batch_size)
+
+def crawl(org: GeneratedOrg) -> int:
+    return org.catalog_pages + org.item_pages
+
+# Allowed number of API calls of each job, from the size of the org and what the job sent through the fake,
+# every term grows with pages, repositories, labels or batches and none with the number of items
+BUDGETS = {
+    'past_due': lambda org, fake: crawl(org) + 2 * org.repos
+        + batches(fake.labeled_issues, github_utils.LABEL_BATCH_SIZE),
+    'resolved_late': lambda org, fake: crawl(org) + 2 * org.repos
+        + batches(fake.timeline_issues, label_afterdues.TIMELINE_BATCH_SIZE) + len(org.overflowing)
+        + batches(fake.labeled_issues, github_utils.LABEL_BATCH_SIZE),
+    'project_label': lambda org, fake: crawl(org) + 2 * org.repos * org.project_count
+        + batches(fake.labeled_issues, github_utils.LABEL_BATCH_SIZE),
+    'notify': lambda org, fake: crawl(org) + 1 + len(fake.recipients)
+        + batches(fake.findings, slack_digest.MAX_BLOCKS - 4),
+    'all': lambda org, fake: crawl(org) + 2 * org.repos * (org.project_count + 2)
+        + batches(fake.timeline_issues, label_afterdues.TIMELINE_BATCH_SIZE) + len(org.overflowing)
+        + batches(fake.labeled_issues, github_utils.LABEL_BATCH_SIZE)
+        + 1 + len(fake.recipients) + batches(fake.findings, slack_digest.MAX_BLOCKS - 4)
+}
+
+JOB_RULES = {job.name: job.rules for job in daemon.JOBS}
+JOB_RULES['all'] = run_all.RULES
+
+# Every job starts cold, as a cron run would
+def reset_caches():
+    with id_cache.cache.lock:
+        id_cache.cache.memory.clear()
+        id_cache.cache.db.execute("DELETE FROM ids")
+        id_cache.cache.db.commit()
+    with notification_ledger.ledger.lock:
+        notification_ledger.ledger.db.execute("DELETE FROM notifications")
+        notification_ledger.ledger.db.commit()
+    user_directory.directory.index = None
+    if os.path.exists(user_directory.directory.path):
+        os.remove(user_directory.directory.path)
+    field_schema.schemas.clear()
+    metrics.reset()
+
+def run_job(job_name: str, org: GeneratedOrg) -> tuple:
+    reset_caches()
+    fake = CountingTransport(org)
+    http_client.client.session.request = http_client.client.write_session.request = fake.request
+    rule_engine.run_rules(JOB_RULES[job_name], github_utils.org_name, github_utils.github_token)
+    return sum(fake.calls.values()), BUDGETS[job_name](org, fake), fake.calls
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the API call budget of every due date job on generated organizations.")
+    parser.add_argument('--jobs', help='Comma separated names of the jobs to check, all jobs by default')
+    parser.add_argument('--verbose', action='store_true', help='Print the calls of each run by query name')
+    args = parser.parse_args()
+    job_names = args.jobs.split(',') if args.jobs else list(BUDGETS)
+
+    failed = []
+    print(f"{'job':<14}{'projects':>9}{'items':>8}{'calls':>8}{'budget':>8}")
+    for project_count, items_per_project in SIZES:
+        org = GeneratedOrg(project_count, items_per_project)
+        for job_name in job_names:
+            calls, budget, counts = run_job(job_name, org)
+            status = 'ok' if calls <= budget else 'OVER BUDGET'
+            print(f"{job_name:<14}{project_count:>9}{project_count * items_per_project:>8}{calls:>8}{budget:>8}  {status}")
+            if args.verbose:
+                print(f"    {dict(counts)}")
+            if calls > budget:
+                failed.append((job_name, project_count * items_per_project, dict(counts)))
+
+    for job_name, items, counts in failed:
+        print(f"{job_name} with {items} items went over its budget: {counts}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+#This script keeps the crawled issues of all open projects as NumPy columns, so org wide numbers such as overdue counts, aging and due date slip are computed on arrays instead of by looping over issues.
+import os
+import glob
+import time
+import logging
+import argparse
+import datetime
+import github_utils
+import label_afterdues
+import rule_engine
+from project_item import ProjectItem, Status
+from script import get_cache_dir
+
+# NumPy is only needed for the snapshots, the other scripts run without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', os.path.join(get_cache_dir(), 'snapshots'))
+# Days overdue at which each aging bucket starts
+AGING_BUCKETS = (0, 7, 30, 90)
+# Days late at which each bucket of the slip distribution starts, negative days are issues done early
+SLIP_BUCKETS = (-30, -7, -1, 0, 1, 7, 30)
+
+# datetime64[D] counts days from 1970-01-01 and NaT is the smallest int64, so dates are collected as plain ints
+EPOCH = datetime.date(1970, 1, 1).toordinal()
+NAT = -2 ** 63
+
+# Columns with one code per issue, each code is an index into the names of the column
+CODED_COLUMNS = ('project', 'repo', 'author')
+
+def require_numpy():
+    if np is None:
+        raise ImportError("Snapshots need NumPy, install it with 'pip install numpy'")
+
+def day_number(day: datetime.date) -> int:
+    return day.toordinal() - EPOCH if day is not None else NAT
+
+class Snapshot:
+    # due and done are datetime64[D] columns with NaT for missing dates, status holds the Status values
+    # The author of an issue is the one the rules notify, so it is the column the per assignee numbers use
+    def __init__(self, today, due, done, status, numbers, codes: dict, names: dict):
+        require_numpy()
+        self.today = np.datetime64(today, 'D')
+        self.due = due
+        self.done = done
+        self.status = status
+        self.numbers = numbers
+        self.codes = codes
+        self.names = names
+
+    def __len__(self) -> int:
+        return len(self.due)
+
+    # Boolean mask of the issues matching every given filter, filters are names of the coded columns or Status values
+    def where(self, status: Status = None, **filters):
+        mask = np.ones(len(self), dtype=bool)
+        if status is not None:
+            mask &= self.status == status.value
+        for column, name in filters.items():
+            names = list(self.names[column])
+            mask &= self.codes[column] == (names.index(name) if name in names else -1)
+        return mask
+
+    # Issues with a due date before today that are not done, the same as the past due rule without the labels
+    def overdue(self):
+        return ~np.isnat(self.due) & (self.due < self.today) & (self.status != Status.DONE.value)
+
+    def days_overdue(self):
+        return (self.today - self.due).astype('int64')
+
+    # Days between the due date and the date the issue was marked Done, for the done issues with both dates
+    def slip_days(self):
+        known = ~np.isnat(self.due) & ~np.isnat(self.done)
+        return (self.done[known] - self.due[known]).astype('int64')
+
+    # Number of issues in mask for each name of a coded column
+    def count_by(self, column: str, mask=None) -> dict:
+        codes = self.codes[column] if mask is None else self.codes[column][mask]
+        counts = np.bincount(codes, minlength=len(self.names[column]))
+        return {name: int(count) for name, count in zip(self.names[column], counts) if count}
+
+    # Overdue issues per aging bucket, e.g. '7 to 29' days overdue
+    def aging(self, mask=None, buckets: tuple = AGING_BUCKETS) -> dict:
+        overdue = self.overdue() if mask is None else self.overdue() & mask
+        counts = np.bincount(np.digitize(self.days_overdue()[overdue], buckets), minlength=len(buckets) + 1)[1:]
+        return {bucket_label(buckets, i): int(count) for i, count in enumerate(counts)}
+
+    def slip_distribution(self, buckets: tuple = SLIP_BUCKETS) -> dict:
+        slip = self.slip_days()
+        counts = np.bincount(np.digitize(slip, buckets), minlength=len(buckets) + 1)
+        distribution = {f"less than {buckets[0]}": int(counts[0])}
+        distribution.update({bucket_label(buckets, i): int(count) for i, count in enumerate(counts[1:])})
+        if len(slip):
+            distribution['median'] = float(np.median(slip))
+            distribution['p90'] = float(np.percentile(slip, 90))
+        return distribution
+
+    # One compressed .npz file per snapshot, the names are stored as fixed width unicode arrays so loading needs no pickle
+    def save(self, path: str):
+        columns = {'today': np.array(self.today), 'due': self.due, 'done': self.done, 'status': self.status, 'numbers': self.numbers}
+        for column in CODED_COLUMNS:
+            columns[f'{column}_codes'] = self.codes[column]
+            columns[f'{column}_names'] = np.array(self.names[column], dtype=str)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temp_path = path + '.tmp.npz'
+        np.savez_compressed(temp_path, **columns)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        require_numpy()
+        with np.load(path, allow_pickle=False) as columns:
+            return cls(columns['today'], columns['due'], columns['done'], columns['status'], columns['numbers'],
+                       {column: columns[f'{column}_codes'] for column in CODED_COLUMNS},
+                       {column: list(columns[f'{column}_names']) for column in CODED_COLUMNS})
+
+def bucket_label(buckets: tuple, i: int) -> str:
+    if i + 1 == len(buckets):
+        return f"{buckets[i]} or more"
+    last = buckets[i + 1] - 1
+    return str(last) if last == buckets[i] else f"{buckets[i]} to {last}"
+
+class SnapshotBuilder:
+    # Collects one row per crawled issue, an issue in several projects gets a row in each of them
+    def __init__(self):
+        self.rows = []
+        self.codes = {column: {} for column in CODED_COLUMNS}
+
+    def code(self, column: str, name: str) -> int:
+        codes = self.codes[column]
+        code = codes.get(name)
+        if code is None:
+            code = codes[name] = len(codes)
+        return code
+
+    def add(self, issue: ProjectItem, project: dict):
+        self.rows.append((
+            issue.issue_id,
+            day_number(issue.due_date),
+            issue.status.value,
+            issue.number,
+            self.code('project', project['title']),
+            self.code('repo', f"{issue.owner}/{issue.repo}"),
+            self.code('author', issue.author_login)
+        ))
+
+    # done_dates are the dates the issues were marked Done keyed by issue ID, see label_afterdues.fetch_done_dates
+    def build(self, done_dates: dict = None, today: datetime.date = None) -> Snapshot:
+        require_numpy()
+        done_dates = done_dates or {}
+        issue_ids, due, status, numbers, projects, repos, authors = zip(*self.rows) if self.rows else ((),) * 7
+        snapshot = Snapshot(
+            today or datetime.date.today(),
+            np.array(due, dtype='int64').astype('datetime64[D]'),
+            np.array([day_number(done_dates.get(issue_id)) for issue_id in issue_ids], dtype='int64').astype('datetime64[D]'),
+            np.array(status, dtype='int8'),
+            np.array(numbers, dtype='int32'),
+            {column: np.array(codes, dtype='int32') for column, codes in zip(CODED_COLUMNS, (projects, repos, authors))},
+            {column: list(self.codes[column]) for column in CODED_COLUMNS}
+        )
+        self.rows.clear()
+        self.codes = {column: {} for column in CODED_COLUMNS}
+        return snapshot
+
+    # The done issues with a due date are the ones the slip distribution needs, their timelines are fetched in batches
+    def done_issue_ids(self) -> list:
+        return sorted(row[0] for row in self.rows if row[0] and row[2] == Status.DONE.value and row[1] != NAT)
+
+def snapshot_path(day: datetime.date) -> str:
+    return os.path.join(SNAPSHOT_DIR, f"snapshot_{day.isoformat()}.npz")
+
+def latest_snapshot_path() -> str:
+    paths = sorted(glob.glob(os.path.join(SNAPSHOT_DIR, 'snapshot_*.npz')))
+    return paths[-1] if paths else None
+
+builder = SnapshotBuilder()
+# Whether the done dates are fetched for the slip distribution, it costs one query per TIMELINE_BATCH_SIZE done issues
+fetch_done = True
+
+# Build the snapshot of the crawl and keep it as the snapshot of today
+def save_snapshot():
+    if not builder.rows:
+        return
+    done_dates = label_afterdues.fetch_done_dates(builder.done_issue_ids(), github_utils.github_token) if fetch_done else {}
+    snapshot = builder.build(done_dates)
+    path = snapshot_path(datetime.date.today())
+    snapshot.save(path)
+    logging.info(f"Saved the snapshot of {len(snapshot)} issues to {path}")
+
+# Every crawled issue goes into the snapshot, it needs no labels
+rule = rule_engine.Rule('snapshot', lambda issue, project: True, builder.add, save_snapshot,
+                        needs={'author', 'due_date', 'status'})
+
+def print_counts(title: str, counts: dict, limit: int = 20):
+    print(title)
+    for name, count in sorted(counts.items(), key=lambda entry: -entry[1])[:limit]:
+        print(f"  {count:>7}  {name}")
+
+def report(snapshot: Snapshot):
+    started = time.perf_counter()
+    overdue = snapshot.overdue()
+    numbers = {
+        'project': snapshot.count_by('project', overdue),
+        'repo': snapshot.count_by('repo', overdue),
+        'author': snapshot.count_by('author', overdue),
+        'aging': snapshot.aging(),
+        'slip': snapshot.slip_distribution()
+    }
+    elapsed = time.perf_counter() - started
+
+    print(f"Snapshot of {snapshot.today}: {len(snapshot)} issues, {int(overdue.sum())} overdue")
+    print_counts("Overdue per project:", numbers['project'])
+    print_counts("Overdue per repository:", numbers['repo'])
+    print_counts("Overdue per assignee:", numbers['author'])
+    print("Overdue aging in days:")
+    for bucket, count in numbers['aging'].items():
+        print(f"  {count:>7}  {bucket}")
+    print("Due date slip in days (done date - due date):")
+    for bucket, value in numbers['slip'].items():
+        print(f"  {value:>7}  {bucket}")
+    logging.debug(f"Computed the report of {len(snapshot)} issues in {elapsed * 1000:.1f}ms")
+    return numbers
+
+def main():
+    global fetch_done
+    parser = argparse.ArgumentParser(description="Take columnar snapshots of the open projects and report overdue numbers from them.")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    crawl = subcommands.add_parser('crawl', help='Crawl the open projects and save the snapshot of today')
+    crawl.add_argument('--no-done-dates', action='store_true', help='Skip the timelines, the slip distribution stays empty')
+    show = subcommands.add_parser('report', help='Print the overdue numbers of a snapshot')
+    show.add_argument('path', nargs='?', help='Snapshot file, the latest one by default')
+    args, _ = parser.parse_known_args()
+
+    require_numpy()
+    if args.command == 'crawl':
+        fetch_done = not args.no_done_dates
+        rule_engine.run_rules([rule], github_utils.org_name, github_utils.github_token)
+        return
+
+    path = args.path or latest_snapshot_path()
+    if path is None:
+        parser.error(f"No snapshot found in {SNAPSHOT_DIR}, run the crawl command first")
+    report(Snapshot.load(path))
+
+if __name__ == "__main__":
+    main()
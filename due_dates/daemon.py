@@ -0,0 +1,154 @@
+#This script runs all due date jobs in one long running process, each on its own interval, so they share the warm HTTP pool, the caches and the latest project list.
+import os
+import time
+import fcntl
+import signal
+import logging
+import argparse
+import threading
+import github_utils
+import rule_engine
+import sync_state
+import field_schema
+import label_planner
+import slack_digest
+import metrics
+import label_pastdue
+import label_afterdues
+import inform_dues
+import inform_domains
+import label_projectname
+from script import get_cache_dir
+
+# The open projects are fetched again when they are older than this, jobs that run close together share them
+CATALOG_MAX_AGE = float(os.environ.get('DAEMON_CATALOG_MAX_AGE_MINUTES', 5)) * 60
+
+def job_interval(job_name: str, default_minutes: float) -> float:
+    return float(os.environ.get(f'DAEMON_INTERVAL_{job_name.upper()}_MINUTES', default_minutes)) * 60
+
+class Job:
+    def __init__(self, name: str, rules: list, interval: float):
+        self.name = name
+        self.rules = rules
+        self.interval = interval
+        self.next_run = 0
+        # Each job keeps its own incremental state, so a run of one job does not hide the changes from another
+        self.state = sync_state.SyncState(os.path.join(get_cache_dir(), f'sync_state_{name}.sqlite3'))
+        # The lock file next to the state keeps a second daemon or a cron run on the same cache directory from running the job too
+        self.lock_path = os.path.join(get_cache_dir(), f'sync_state_{name}.lock')
+
+    # Returns the open lock file, closing it releases the lock, or None when another process is running the job
+    def acquire(self):
+        lock_file = open(self.lock_path, 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        return lock_file
+
+# The notifier rules share one job, so each user still gets one digest for both of them
+JOBS = [
+    Job('past_due', [label_pastdue.rule], job_interval('past_due', 15)),
+    Job('resolved_late', [label_afterdues.rule], job_interval('resolved_late', 60)),
+    Job('project_label', [label_projectname.rule], job_interval('project_label', 30)),
+    Job('notify', [inform_dues.rule, inform_domains.rule], job_interval('notify', 60))
+]
+
+class ProjectSnapshot:
+    def __init__(self, max_age: float = CATALOG_MAX_AGE):
+        self.max_age = max_age
+        self.projects = None
+        self.fetched_at = 0
+
+    def get(self, org_name: str, github_token: str) -> list:
+        if self.projects is None or time.time() - self.fetched_at >= self.max_age:
+            # A failed catalog is not kept, the next job fetches it again
+            projects = rule_engine.fetch_open_projects(org_name, github_token)
+            if projects is None:
+                return None
+            self.projects = projects
+            self.fetched_at = time.time()
+            # The field schemas are built from the catalog, so they are built again with it
+            field_schema.schemas.clear()
+        return self.projects
+
+# Drop what a failed run left queued, so it is not sent by the next job
+def reset_run_state():
+    label_planner.planner.plans.clear()
+    slack_digest.digest.findings.clear()
+    label_afterdues.candidates.clear()
+    github_utils.label_writer.pending.clear()
+    github_utils.label_writer.failed.clear()
+
+class Daemon:
+    def __init__(self, jobs: list, org_name: str, github_token: str):
+        self.jobs = jobs
+        self.org_name = org_name
+        self.github_token = github_token
+        self.snapshot = ProjectSnapshot()
+        self.stop_event = threading.Event()
+
+    def run_job(self, job: Job):
+        lock_file = job.acquire()
+        if lock_file is None:
+            logging.info(f"Job {job.name} is running in another process, skipping it")
+            job.next_run = time.time() + job.interval
+            return
+        started = time.time()
+        try:
+            open_projects = self.snapshot.get(self.org_name, self.github_token)
+            if open_projects is None:
+                logging.error(f"Job {job.name} was skipped, the open projects could not be fetched")
+                return
+            matches = rule_engine.run_rules(job.rules, self.org_name, self.github_token, incremental=True,
+                                            state=job.state, open_projects=open_projects)
+            logging.info(f"Job {job.name} finished in {time.time() - started:.1f}s: {matches}")
+        except Exception:
+            logging.exception(f"Job {job.name} failed")
+            reset_run_state()
+        finally:
+            job.next_run = time.time() + job.interval
+            lock_file.close()
+            # Each job has its own files, the jobs run on different intervals
+            metrics.export(name=f'due_dates_{job.name}')
+            metrics.reset()
+
+    # The job that is running is finished before the daemon stops
+    def stop(self, signum=None, frame=None):
+        logging.info(f"Stopping the daemon after the current job (signal {signum})")
+        self.stop_event.set()
+
+    def run(self, once: bool = False):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        logging.info(f"Daemon started with jobs: {', '.join(job.name for job in self.jobs)}")
+
+        while not self.stop_event.is_set():
+            for job in self.jobs:
+                if self.stop_event.is_set():
+                    break
+                if job.next_run <= time.time():
+                    self.run_job(job)
+            if once:
+                break
+            next_run = min(job.next_run for job in self.jobs)
+            self.stop_event.wait(max(0, next_run - time.time()))
+
+        logging.info("Daemon stopped")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the due date jobs on their intervals in one process.")
+    parser.add_argument('--jobs', help='Comma separated names of the jobs to run, all jobs by default')
+    parser.add_argument('--once', action='store_true', help='Run every job once and exit')
+    args, _ = parser.parse_known_args()
+
+    jobs = JOBS
+    if args.jobs:
+        names = args.jobs.split(',')
+        jobs = [job for job in JOBS if job.name in names]
+
+    Daemon(jobs, github_utils.org_name, github_utils.github_token).run(once=args.once)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#This script resolves the fields of each project (Due Date, Status and its Done options, Domain) to their IDs once per run, so rules compare IDs instead of names.
+import re
+import logging
+import github_utils
+import metrics
+import queries
+
+NON_WORD = re.compile(r'\W+')
+DONE = re.compile(r'\bdone\b', re.IGNORECASE)
+
+query_project_fields = queries.register('project_fields', """
+query($org_name: String!, $number: Int!) {
+  organization(login: $org_name) {
+    projectV2(number: $number) {
+      id
+%s
+    }
+  }
+}
+""" % github_utils.FIELDS_SELECTION)
+
+class FieldSchema:
+    def __init__(self, fields: list):
+        # kinds maps a field ID to what the rules use it for: due_date, status or domain
+        self.kinds = {}
+        self.names = {}
+        self.done_option_ids = set()
+
+        for field in fields:
+            if not field or 'id' not in field:
+                continue
+            name = field.get('name', '')
+            self.names[name] = field['id']
+            sanitized = NON_WORD.sub('', name)
+            if sanitized == "DueDate":
+                self.kinds[field['id']] = 'due_date'
+            elif sanitized == "Status":
+                self.kinds[field['id']] = 'status'
+                for option in field.get('options') or []:
+                    if DONE.search(NON_WORD.sub('', option['name'])):
+                        self.done_option_ids.add(option['id'])
+            elif name == "Domain":
+                self.kinds[field['id']] = 'domain'
+
+    def field_id(self, kind: str) -> str:
+        for field_id, field_kind in self.kinds.items():
+            if field_kind == kind:
+                return field_id
+        return None
+
+    def field_name(self, kind: str) -> str:
+        field_id = self.field_id(kind)
+        for name, name_id in self.names.items():
+            if name_id == field_id:
+                return name
+        return None
+
+# Schemas of the projects seen in this run, keyed by project number
+schemas = {}
+
+# The catalog already asks for the fields, so the schema of a catalog project costs no extra call
+def schema_from_project(project: dict) -> FieldSchema:
+    if project['number'] not in schemas and 'fields' in project:
+        schemas[project['number']] = FieldSchema(project['fields']['nodes'])
+    return schemas.get(project['number'])
+
+def fetch_field_schema(project_number: int, org_name: str, github_token: str) -> FieldSchema:
+    if project_number in schemas:
+        return schemas[project_number]
+
+    variables = {
+        "org_name": org_name,
+        "number": project_number
+    }
+    with metrics.phase('catalog'):
+        result = github_utils.run_query(query_project_fields, variables, github_token)
+
+    if 'errors' in result or not result.get('data') or not result['data']['organization']['projectV2']:
+        logging.error(f"Could not fetch the fields of project {project_number}: {result.get('errors')}")
+        return None
+
+    schema = schemas[project_number] = FieldSchema(result['data']['organization']['projectV2']['fields']['nodes'])
+    logging.debug("Fetched %d fields of project %s", len(schema.names), project_number)
+    return schema
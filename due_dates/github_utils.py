@@ -1,6 +1,11 @@
 #In this script, there are some required functions for other scripts implemented
 import os
-import requests
+import http_client
+import id_cache
+import rate_limit
+import metrics
+import queries
+from project_item import ProjectItem, decode_item
 import json
 import re
 from datetime import datetime
@@ -17,393 +22,587 @@ logging.basicConfig(
 )
 
 GITHUB_API_URL = 'https://api.github.com/graphql'
+# Number of label mutations sent in one GraphQL document
+LABEL_BATCH_SIZE = int(os.environ.get('LABEL_BATCH_SIZE', 25))
+
+# GraphQL selection of the fields of a project, the catalog asks for it so field_schema needs no call per project
+FIELDS_SELECTION = """
+        fields(first: 50) {
+          nodes {
+            ... on ProjectV2FieldCommon {
+              id
+              name
+              dataType
+            }
+            ... on ProjectV2SingleSelectField {
+              options {
+                id
+                name
+              }
+            }
+          }
+        }
+"""
 
-# GraphQL query to fetch projects
-def get_query_projects(org_name:str):
-    return """
-{
-  organization(login: "%s") {
-    projectsV2(first: 100) {
+# GraphQL query to fetch the project catalog, one page of projects with everything the scripts need to know about them
+query_project_catalog = queries.register('project_catalog', """
+query($org_name: String!, $after: String, $search: String) {
+  rateLimit {
+    cost
+    remaining
+    resetAt
+  }
+  organization(login: $org_name) {
+    projectsV2(first: 100, after: $after, query: $search) {
+      pageInfo {
+        hasNextPage
+        endCursor
+      }
       nodes {
         id
         title
         number
+        closed
+        updatedAt
+        items {
+          totalCount
+        }
+%s
       }
     }
   }
 }
-""" % org_name
-
-# GraphQL query to fetch project details
-query_project_details = """
-query($id: ID!) {
-  node(id: $id) {
-    ... on ProjectV2 {
-      id
-      title
-      number
-      closed
-    }
-  }
-}
-"""
+""" % FIELDS_SELECTION)
 
+# Queries are retried on any error, mutations only when they surely did not reach GitHub (see http_client.HttpClient)
+def post_query(body: bytes, headers: dict, name: str, idempotent: bool = True):
+    rate_limit.governor.before_call()
+    response = http_client.post(GITHUB_API_URL, name, idempotent, data=body, headers=headers)
+    rate_limit.governor.update_from_headers(response.headers)
 
+    # Out of rate limit, wait for the reset and try once more instead of failing with half of the work done
+    if response.status_code in (403, 429) and response.headers.get('x-ratelimit-remaining') == '0':
+        rate_limit.governor.wait_for_reset()
+        response = http_client.post(GITHUB_API_URL, name, idempotent, data=body, headers=headers)
+        rate_limit.governor.update_from_headers(response.headers)
 
+    if response.status_code != 200:
+        logging.error(f"Query failed to run with status code {response.status_code}: {response.text}")
+        raise Exception(f"Query failed to run with status code {response.status_code}: {response.text}")
+    return response
 
-def run_query(query: str, variables: dict, github_token: str) -> dict:
+# query is a registered document (see queries.py) or a plain query string, name tags the call in the metrics of the run
+def run_query(query, variables: dict, github_token: str, name: str = None) -> dict:
     if not github_token:
         logging.error("No GITHUB_TOKEN found in environment variables")
         raise ValueError("No GITHUB_TOKEN found in environment variables")
 
     headers = {
-        'Authorization': f'Bearer {github_token}'
+        'Authorization': f'Bearer {github_token}',
+        'Content-Type': 'application/json'
     }
 
-    json_data = {'query': query}
-    if variables:
-        json_data['variables'] = variables
+    if not isinstance(query, queries.Query):
+        query = queries.Query(name or 'graphql', query)
+    name = name or query.name
+
+    # With persisted queries only the hash is sent, the full document is sent once if the backend does not know it yet
+    persisted = queries.PERSISTED_QUERIES
+    idempotent = not query.is_mutation
+    response = post_query(query.body(variables, persisted, include_query=not persisted), headers, name, idempotent)
+    result = response.json()
+    if persisted and any(error.get('message') == 'PersistedQueryNotFound' for error in result.get('errors', [])):
+        response = post_query(query.body(variables, persisted), headers, name, idempotent)
+        result = response.json()
+
+    # GitHub answers an exhausted GraphQL limit with a 200 and a RATE_LIMITED error, so it is retried after the reset as well
+    if any(error.get('type') == 'RATE_LIMITED' for error in result.get('errors', [])):
+        rate_limit.governor.wait_for_reset()
+        response = post_query(query.body(variables, persisted), headers, name, idempotent)
+        result = response.json()
 
-    response = requests.post(GITHUB_API_URL, json=json_data, headers=headers)
+    logging.debug("Query successful")
+    rate_limit.governor.update_from_result(result)
+    if result.get('data') and result['data'].get('rateLimit'):
+        response.span.cost = result['data']['rateLimit']['cost']
+    return result
+
+# Fetch all projects of the organization page by page, with open_only the closed projects are filtered by GitHub and checked again here
+# Returns None when a page of the catalog could not be fetched
+def fetch_project_catalog(org_name: str, github_token: str, open_only: bool = False) -> list:
+    projects = []
+    after_cursor = None
 
-    if response.status_code != 200:
-        logging.error(f"Query failed to run with status code {response.status_code}: {response.text}")
-        raise Exception(f"Query failed to run with status code {response.status_code}: {response.text}")
+    while True:
+        variables = {
+            "org_name": org_name,
+            "after": after_cursor,
+            "search": "is:open" if open_only else None
+        }
+        with metrics.phase('catalog'):
+            result = run_query(query_project_catalog, variables, github_token)
 
-    logging.debug("Query successful")
-    return response.json()
+        # A partial catalog would look like closed projects to the incremental state, so no catalog is returned
+        if 'errors' in result:
+            logging.error(f"Errors in the query response for the project catalog: {result['errors']}")
+            return None
 
-def fetch_projects(org_name: str, github_token: str) -> list:
-    query = get_query_projects(org_name)  # Call get_query_projects to get the query string
-    result = run_query(query, None, github_token)
-    logging.debug(f"Fetched projects: {result}")
-    return result['data']['organization']['projectsV2']['nodes']
-
-def fetch_project_details(project_id: str, github_token: str) -> dict:
-    variables = {"id": project_id}
-    result = run_query(query_project_details, variables, github_token)
-    
-    if 'errors' in result:
-        logging.error(f"Errors in the query response for project {project_id}: {result['errors']}")
-        return None
+        if 'data' not in result:
+            logging.error("No data in the query response for the project catalog.")
+            return None
 
-    if 'data' not in result:
-        logging.error(f"No data in the query response for project {project_id}.")
-        return None
+        catalog = result['data']['organization']['projectsV2']
+        projects.extend(catalog['nodes'])
 
-    project = result['data']['node']
-    logging.debug(f"Fetched project details: {project}")
-    return project
+        if not catalog['pageInfo']['hasNextPage']:
+            break
 
-def get_query(project_number: int, after_cursor: str, org_name: str) -> str:
-    after_part = f', after: "{after_cursor}"' if after_cursor else ''
-    return f"""
-    {{
-      organization(login: "{org_name}") {{
-        projectV2(number: {project_number}) {{
-          id
-          title
-          items(first: 100{after_part}) {{
-            pageInfo {{
-              hasNextPage
-              endCursor
-            }}
-            nodes {{
-              id
-              content {{
-                ... on Issue {{
-                  title
-                  number
-                  repository {{
-                    nameWithOwner
-                  }}
-                  author {{
-                    login
-                  }}
-                  labels(first: 10) {{
-                    nodes {{
-                      name
-                    }}
-                  }}
-                }}
-              }}
-              fieldValues(first: 10) {{
-                nodes {{
-                  ... on ProjectV2ItemFieldDateValue {{
-                    date
-                    field {{
-                      ... on ProjectV2FieldCommon {{
-                        name
-                      }}
-                    }}
-                  }}
-                  ... on ProjectV2ItemFieldSingleSelectValue {{
-                    name
-                    field {{
-                      ... on ProjectV2FieldCommon {{
-                        name
-                      }}
-                    }}
-                  }}
-                }}
-              }}
-            }}
-          }}
-        }}
-      }}
-    }}
-    """
+        after_cursor = catalog['pageInfo']['endCursor']
 
-def fetch_all_project_items(project_number: int, org_name: str, github_token: str) -> list:
-    all_items = []
-    after_cursor = None
+    if open_only:
+        projects = [project for project in projects if not project['closed']]
 
-    while True:
-        query = get_query(project_number, after_cursor, org_name)
-        result = run_query(query, None, github_token)
+    logging.debug(f"Fetched {len(projects)} projects")
+    return projects
 
-        if 'errors' in result:
-            logging.error(f"Errors in the query response: {result['errors']}")
-            return all_items
+def fetch_projects(org_name: str, github_token: str) -> list:
+    return fetch_project_catalog(org_name, github_token) or []
 
-        if 'data' not in result:
-            logging.error("No data in the query response.")
-            return all_items
+# Parts of an item the rules can ask the crawl for, the IDs, title, number and repository are always fetched
+ALL_NEEDS = frozenset({'labels', 'author', 'due_date', 'status', 'domain'})
 
-        project = result['data']['organization']['projectV2']
-        project_items = project['items']['nodes']
-        all_items.extend(project_items)
+DATE_VALUE_FRAGMENT = """
+                  ... on ProjectV2ItemFieldDateValue {
+                    date
+                    field {
+                      ... on ProjectV2FieldCommon {
+                        id
+                        name
+                      }
+                    }
+                  }"""
 
-        page_info = project['items']['pageInfo']
-        if not page_info['hasNextPage']:
-            break
+SINGLE_SELECT_VALUE_FRAGMENT = """
+                  ... on ProjectV2ItemFieldSingleSelectValue {
+                    name
+                    optionId
+                    field {
+                      ... on ProjectV2FieldCommon {
+                        id
+                        name
+                      }
+                    }
+                  }"""
 
-        after_cursor = page_info['endCursor']
+FIELD_VALUE_FRAGMENTS = DATE_VALUE_FRAGMENT + SINGLE_SELECT_VALUE_FRAGMENT
 
-    logging.debug(f"Fetched all project items: {all_items}")
-    return all_items
+AUTHOR_SELECTION = """
+                  author {
+                    login
+                    ... on User {
+                      id
+                    }
+                  }"""
 
-def sanitize(text: str) -> str:
-    return re.sub(r'\W+', '', text)
+LABELS_SELECTION = """
+                  labels(first: 10) {
+                    nodes {
+                      name
+                    }
+                  }"""
 
-def fetch_project_details_by_number(project_number: int, org_name: str, github_token: str) -> dict:
-    #Fetch project details by project number
-    query_project_by_number = """
-    query($org_name: String!, $project_number: Int!) {
-      organization(login: $org_name) {
-        projectV2(number: $project_number) {
-          id
-          title
-          closed
-          number
-          items(first: 100) {
-            nodes {
+# Alias, name variable and value fragments of each field the crawl can look up by name, Domain can be of either type
+FIELD_ALIASES = {
+    'due_date': ('dueDate', 'dueDateField', DATE_VALUE_FRAGMENT),
+    'status': ('status', 'statusField', SINGLE_SELECT_VALUE_FRAGMENT),
+    'domain': ('domain', 'domainField', FIELD_VALUE_FRAGMENTS)
+}
+
+# Fields the crawl looks up by name for these needs, None if the field values are listed instead (no field schema)
+def get_field_kinds(needs: frozenset, schema=None):
+    field_needs = [kind for kind in FIELD_ALIASES if kind in needs]
+    if not field_needs:
+        return ()
+    if schema is None:
+        return None
+    return tuple(kind for kind in field_needs if schema.field_name(kind) is not None)
+
+# Selection of the field values an item needs, with the field schema each field is looked up by name,
+# without it the first 10 field values are fetched and matched by name
+def get_field_values_selection(field_kinds) -> str:
+    if field_kinds is None:
+        return """
+              fieldValues(first: 10) {
+                nodes {%s
+                }
+              }""" % FIELD_VALUE_FRAGMENTS
+
+    selection = ""
+    for kind in field_kinds:
+        alias, variable, fragments = FIELD_ALIASES[kind]
+        selection += """
+              %s: fieldValueByName(name: $%s) {%s
+              }""" % (alias, variable, fragments)
+    return selection
+
+# Fields of a project item, the same for a page of a project and for a single item
+def get_item_selection(needs: frozenset, field_kinds) -> str:
+    author_part = AUTHOR_SELECTION if 'author' in needs else ''
+    labels_part = LABELS_SELECTION if 'labels' in needs else ''
+    return """
               id
+              updatedAt
               content {
                 ... on Issue {
                   id
+                  updatedAt
                   title
                   number
-                  labels(first: 10) {
-                    nodes {
-                      name
-                    }
-                  }
                   repository {
+                    id
                     nameWithOwner
-                  }
-                  author {
-                    login
-                  }
+                  }%s%s
                 }
-              }
+              }%s""" % (author_part, labels_part, get_field_values_selection(field_kinds))
+
+# The document only depends on the needs and on which fields are looked up by name, so each shape is registered once
+def get_items_query(needs: frozenset = ALL_NEEDS, schema=None) -> queries.Query:
+    field_kinds = get_field_kinds(needs, schema)
+    parts = [part for part in ('author', 'labels') if part in needs]
+    key = "project_items:%s:%s" % (",".join(parts), "fieldValues" if field_kinds is None else ",".join(field_kinds))
+    if key in queries.registry:
+        return queries.registry[key]
+
+    field_variables = "".join(", $%s: String!" % FIELD_ALIASES[kind][1] for kind in field_kinds or ())
+    return queries.register(key, """
+    query($org_name: String!, $number: Int!, $after: String%s) {
+      rateLimit {
+        cost
+        remaining
+        resetAt
+      }
+      organization(login: $org_name) {
+        projectV2(number: $number) {
+          id
+          title
+          items(first: 100, after: $after) {
+            pageInfo {
+              hasNextPage
+              endCursor
+            }
+            nodes {%s
             }
           }
         }
       }
     }
-    """
+    """ % (field_variables, get_item_selection(needs, field_kinds)))
+
+def get_items_variables(project_number: int, after_cursor: str, org_name: str, needs: frozenset = ALL_NEEDS, schema=None) -> dict:
     variables = {
         "org_name": org_name,
-        "project_number": project_number
+        "number": project_number,
+        "after": after_cursor
     }
-    result = run_query(query_project_by_number, variables, github_token)
-    
+    for kind in get_field_kinds(needs, schema) or ():
+        variables[FIELD_ALIASES[kind][1]] = schema.field_name(kind)
+    return variables
+
+# The full crawl is the most common shape, register it at import
+get_items_query()
+
+# Fetch one page of project items, returns the items and the pageInfo, or None if the query failed
+def fetch_project_items_page(project_number: int, after_cursor: str, org_name: str, github_token: str,
+                             needs: frozenset = ALL_NEEDS, schema=None):
+    query = get_items_query(needs, schema)
+    variables = get_items_variables(project_number, after_cursor, org_name, needs, schema)
+    with metrics.phase('crawl'):
+        result = run_query(query, variables, github_token, 'project_items')
+
     if 'errors' in result:
-        logging.error(f"Errors in the query response for project number {project_number}: {result['errors']}")
+        logging.error(f"Errors in the query response: {result['errors']}")
         return None
 
-    if 'data' not in result or not result['data']['organization']['projectV2']:
-        logging.error(f"No data found for project number {project_number}.")
+    if 'data' not in result:
+        logging.error("No data in the query response.")
         return None
 
     project = result['data']['organization']['projectV2']
-    logging.debug(f"Fetched project details for project number {project_number}: {project}")
-    return project
+    return project['items']['nodes'], project['items']['pageInfo']
+
+# A single project item by its node ID, with the number of its project
+query_project_item = queries.register('project_item', """
+query($id: ID!) {
+  node(id: $id) {
+    ... on ProjectV2Item {%s
+      project {
+        number
+      }
+    }
+  }
+}
+""" % get_item_selection(ALL_NEEDS, None))
+
+# The project items of an issue, one per project the issue is in
+query_issue_project_items = queries.register('issue_project_items', """
+query($id: ID!) {
+  node(id: $id) {
+    ... on Issue {
+      projectItems(first: 20) {
+        nodes {%s
+          project {
+            number
+          }
+        }
+      }
+    }
+  }
+}
+""" % get_item_selection(ALL_NEEDS, None))
+
+# Fetch the project items of a project item or issue node ID, returns the item nodes or an empty list if the query failed
+def fetch_items_of_node(node_id: str, github_token: str, is_issue: bool = False) -> list:
+    query = query_issue_project_items if is_issue else query_project_item
+    with metrics.phase('crawl'):
+        result = run_query(query, {"id": node_id}, github_token)
+
+    if 'errors' in result or not result.get('data') or not result['data']['node']:
+        logging.error(f"Could not fetch the project items of {node_id}: {result.get('errors')}")
+        return []
 
+    node = result['data']['node']
+    if is_issue:
+        return node['projectItems']['nodes']
+    return [node] if 'project' in node else []
+
+# Yield the items of a project page by page, only one page is kept in memory
+def iter_project_items(project_number: int, org_name: str, github_token: str):
+    after_cursor = None
+    item_count = 0
+
+    while True:
+        page = fetch_project_items_page(project_number, after_cursor, org_name, github_token)
+        if page is None:
+            return
+
+        project_items, page_info = page
+        item_count += len(project_items)
+        logging.debug("Fetched %d items of project %s after cursor %s", len(project_items), project_number, after_cursor)
+        yield from project_items
+
+        if not page_info['hasNextPage']:
+            break
+
+        after_cursor = page_info['endCursor']
+
+    logging.debug("Fetched all %d items of project %s", item_count, project_number)
+
+def fetch_all_project_items(project_number: int, org_name: str, github_token: str) -> list:
+    return list(iter_project_items(project_number, org_name, github_token))
+
+def sanitize(text: str) -> str:
+    return re.sub(r'\W+', '', text)
+
+# An issue is past due if it is not in the backlog, not done and its due date has passed
+def is_past_due(issue: ProjectItem, current_date) -> bool:
+    if "Backlog" in issue.labels or issue.is_done:
+        return False
+    return issue.due_date is not None and issue.due_date < current_date
 
 def list_past_due_issues(project_number: int, org_name: str, github_token: str) -> list:
-    project_items = fetch_all_project_items(project_number, org_name, github_token)
+    project_items = iter_project_items(project_number, org_name, github_token)
     current_date = datetime.now().date()
     past_due_issues = []
 
     for item in project_items:
-        content = item.get('content')
-        if content and 'title' in content and 'number' in content:
-            title = content['title']
-            number = content['number']
-            labels = [label['name'] for label in content['labels']['nodes']]
-            repository = content['repository']['nameWithOwner'].split('/')
-            owner = repository[0]
-            repo = repository[1]
-
-            # Check for "Backlog" label
-            if "Backlog" in labels:
-                continue
-            
-            has_due_date = False
-            is_done = False
-            due_date = None
-
-            for field in item.get('fieldValues', {}).get('nodes', []):
-                field_name = sanitize(field.get('field', {}).get('name', ''))
-                field_value = sanitize(field.get('name', ''))
-
-                if field_name == "DueDate" and field.get('date'):
-                    has_due_date = True
-                    due_date = datetime.strptime(field.get('date'), '%Y-%m-%d').date()
-                if field_name == "Status" and re.search(r'\bdone\b', field_value, re.IGNORECASE):
-                    is_done = True
-
-            if is_done:
-                continue
-
-            if has_due_date and due_date < current_date:
-                past_due_issues.append({
-                    'owner': owner,
-                    'repo': repo,
-                    'number': number,
-                    'title': title,
-                    'due_date': due_date
-                })
-
-    logging.debug(f"Listed past due issues: {past_due_issues}")
+        issue = decode_item(item)
+        if issue and is_past_due(issue, current_date):
+            past_due_issues.append({
+                'owner': issue.owner,
+                'repo': issue.repo,
+                'number': issue.number,
+                'title': issue.title,
+                'due_date': issue.due_date,
+                'issue_id': issue.issue_id,
+                'repository_id': issue.repository_id,
+                'author_id': issue.author_id
+            })
+
+    logging.debug("Listed %d past due issues of project %s", len(past_due_issues), project_number)
     return past_due_issues
 
-# Function to get the repository ID
-def get_repository_id(org_name: str, repo_name: str, github_token: str) -> str:
-    repository_query = '''
-    query($organization: String!, $repo: String!) {
-      organization(login: $organization) {
-        repository(name: $repo) {
-          id
+# Documents of the ID resolvers and label mutations
+query_repository_id = queries.register('repository_id', """
+query($organization: String!, $repo: String!) {
+  organization(login: $organization) {
+    repository(name: $repo) {
+      id
+    }
+  }
+}
+""")
+
+query_issue_id = queries.register('issue_id', """
+query($organization: String!, $repo: String!, $number: Int!) {
+  organization(login: $organization) {
+    repository(name: $repo) {
+      issue(number: $number) {
+        id
+      }
+    }
+  }
+}
+""")
+
+query_label_id = queries.register('label_id', """
+query($organization: String!, $repo: String!, $name: String!) {
+  organization(login: $organization) {
+    repository(name: $repo) {
+      label(name: $name) {
+        id
+      }
+    }
+  }
+}
+""")
+
+mutation_create_label = queries.register('create_label', """
+mutation($repositoryId: ID!, $name: String!, $color: String!, $description: String) {
+  createLabel(input: {repositoryId: $repositoryId, name: $name, color: $color, description: $description}) {
+    label {
+      id
+      name
+    }
+  }
+}
+""")
+
+mutation_add_label = queries.register('add_label', """
+mutation($issueId: ID!, $labelIds: [ID!]!) {
+  addLabelsToLabelable(input: {labelableId: $issueId, labelIds: $labelIds}) {
+    labelable {
+      labels(first: 10) {
+        nodes {
+          name
         }
       }
     }
-    '''
+  }
+}
+""")
+
+query_user_id = queries.register('user_id', """
+query($login: String!) {
+  user(login: $login) {
+    id
+  }
+}
+""")
+
+# Function to get the repository ID
+def get_repository_id(org_name: str, repo_name: str, github_token: str) -> str:
+    cache_key = f"{org_name}/{repo_name}"
+    repository_id = id_cache.cache.get('repository', cache_key)
+    if repository_id:
+        return repository_id
+
     repo_variables = {
         "organization": org_name,
         "repo": repo_name
     }
-    repo_data = run_query(repository_query, repo_variables, github_token)
+    with metrics.phase('resolve'):
+        repo_data = run_query(query_repository_id, repo_variables, github_token)
     if 'data' in repo_data and repo_data['data']['organization'] and repo_data['data']['organization']['repository']:
-        logging.debug(f"Repository ID fetched: {repo_data['data']['organization']['repository']['id']}")
-        return repo_data['data']['organization']['repository']['id']
+        repository_id = repo_data['data']['organization']['repository']['id']
+        logging.debug(f"Repository ID fetched: {repository_id}")
+        id_cache.cache.set('repository', cache_key, repository_id)
+        return repository_id
     else:
         logging.error(f"Repository {repo_name} in organization {org_name} not found or access issue.")
         return None
 
 # Function to get the issue ID
 def get_issue_id(org_name: str, repo_name: str, issue_number: int, github_token: str) -> str:
-    issue_query = '''
-    query($organization: String!, $repo: String!, $number: Int!) {
-      organization(login: $organization) {
-        repository(name: $repo) {
-          issue(number: $number) {
-            id
-          }
-        }
-      }
-    }
-    '''
+    cache_key = f"{org_name}/{repo_name}#{issue_number}"
+    issue_id = id_cache.cache.get('issue', cache_key)
+    if issue_id:
+        return issue_id
+
     issue_variables = {
         "organization": org_name,
         "repo": repo_name,
         "number": issue_number
     }
-    issue_data = run_query(issue_query, issue_variables, github_token)
+    with metrics.phase('resolve'):
+        issue_data = run_query(query_issue_id, issue_variables, github_token)
     if 'data' in issue_data and issue_data['data']['organization'] and issue_data['data']['organization']['repository'] and issue_data['data']['organization']['repository']['issue']:
-        logging.debug(f"Issue ID fetched: {issue_data['data']['organization']['repository']['issue']['id']}")
-        return issue_data['data']['organization']['repository']['issue']['id']
+        issue_id = issue_data['data']['organization']['repository']['issue']['id']
+        logging.debug(f"Issue ID fetched: {issue_id}")
+        id_cache.cache.set('issue', cache_key, issue_id)
+        return issue_id
     else:
         logging.error(f"Issue #{issue_number} in repository {repo_name} not found or access issue.")
         return None
 
-# Function to check if the "Past Due" label exists and get its ID, or create it if it doesn't exist
+# Color and description of the labels the rules create, other labels get GitHub's default color
+LABEL_STYLES = {
+    'Past Due': ("FFC0CB", "This issue is past due"),  # Pink color for "Past Due" label
+    'Resolved Late': ("E67E22", "This issue is resolved after due date.")  # Burnt orange color for "Resolved Late" label
+}
+DEFAULT_LABEL_COLOR = "EDEDED"
+
+# Function to check if the label exists and get its ID, or create it if it doesn't exist
+# Returns None when the label can neither be found nor created, e.g. a repository outside the organization or a name over 50 characters
 def get_or_create_label_id(org_name: str, repo_name: str, repository_id: str, github_token: str, label_name:str) -> str:
-    label_query = '''
-    query($organization: String!, $repo: String!, $name: String!) {
-      organization(login: $organization) {
-        repository(name: $repo) {
-          label(name: $name) {
-            id
-          }
-        }
-      }
-    }
-    '''
+    cache_key = f"{org_name}/{repo_name}:{label_name}"
+    label_id = id_cache.cache.get('label', cache_key)
+    if label_id:
+        return label_id
+
     label_variables = {
         "organization": org_name,
         "repo": repo_name,
         "name": label_name
     }
-    label_data = run_query(label_query, label_variables, github_token)
-    label_info = label_data['data']['organization']['repository']['label']
+    with metrics.phase('resolve'):
+        label_data = run_query(query_label_id, label_variables, github_token)
+    repository = ((label_data.get('data') or {}).get('organization') or {}).get('repository')
+    if repository is None:
+        logging.error(f"Could not look up the label {label_name} in {org_name}/{repo_name}: {label_data.get('errors')}")
+        return None
+    label_info = repository['label']
 
     if label_info is None:
-        create_label_mutation = '''
-        mutation($repositoryId: ID!, $name: String!, $color: String!, $description: String) {
-          createLabel(input: {repositoryId: $repositoryId, name: $name, color: $color, description: $description}) {
-            label {
-              id
-              name
-            }
-          }
-        }
-        '''
+        color, description = LABEL_STYLES.get(label_name, (DEFAULT_LABEL_COLOR, None))
         label_variables = {
             "repositoryId": repository_id,
-            "name": "Past Due",
-            "color": "FFC0CB",  # Pink color for "Past Due" label
-            "description": "This issue is past due"
+            "name": label_name,
+            "color": color,
+            "description": description
         }
-        label_data = run_query(create_label_mutation, label_variables, github_token)
-        logging.debug(f"Label created: {label_data['data']['createLabel']['label']['id']}")
-        return label_data['data']['createLabel']['label']['id']
+        with metrics.phase('mutate'):
+            label_data = run_query(mutation_create_label, label_variables, github_token)
+        created = ((label_data.get('data') or {}).get('createLabel') or {}).get('label')
+        if created is None:
+            logging.error(f"Could not create the label {label_name} in {org_name}/{repo_name}: {label_data.get('errors')}")
+            return None
+        label_id = created['id']
+        logging.debug(f"Label created: {label_id}")
     else:
-        logging.debug(f"Label ID fetched: {label_info['id']}")
-        return label_info['id']
+        label_id = label_info['id']
+        logging.debug(f"Label ID fetched: {label_id}")
+
+    id_cache.cache.set('label', cache_key, label_id)
+    return label_id
 
 # Function to add the "Past Due" label to the issue
 def add_label_to_issue(issue_id: str, label_id: str, github_token: str):
-    add_label_mutation = '''
-    mutation($issueId: ID!, $labelIds: [ID!]!) {
-      addLabelsToLabelable(input: {labelableId: $issueId, labelIds: $labelIds}) {
-        labelable {
-          labels(first: 10) {
-            nodes {
-              name
-            }
-          }
-        }
-      }
-    }
-    '''
     add_label_variables = {
         "issueId": issue_id,
         "labelIds": [label_id]
     }
-    labeling_data = run_query(add_label_mutation, add_label_variables, github_token)
+    with metrics.phase('mutate'):
+        labeling_data = run_query(mutation_add_label, add_label_variables, github_token)
     if 'errors' in labeling_data:
         logging.error(f"Error adding label to the issue: {labeling_data['errors']}")
     else:
@@ -411,18 +610,118 @@ def add_label_to_issue(issue_id: str, label_id: str, github_token: str):
         for label in labeling_data['data']['addLabelsToLabelable']['labelable']['labels']['nodes']:
             logging.debug(f"- {label['name']}")
 
-def get_user_id_query(login: str) -> str:
-    return f"""
-    {{
-      user(login: "{login}") {{
-        id
-      }}
-    }}
-    """
+# Build one mutation document that changes the labels of many issues, each addLabelsToLabelable and
+# removeLabelsFromLabelable call gets its own alias, changes are (issue ID, label IDs to add, label IDs to remove)
+# A document is registered once per shape of the batch, sorting the batch keeps the number of shapes small
+def get_batch_label_mutation(changes: list) -> queries.Query:
+    shape = "".join("b" if add_ids and remove_ids else "a" if add_ids else "r" for _, add_ids, remove_ids in changes)
+    key = "label_changes:" + shape
+    if key in queries.registry:
+        return queries.registry[key]
+    variables = []
+    fields = []
+    for i, kind in enumerate(shape):
+        variables.append(f"$issue{i}: ID!")
+        if kind in "ab":
+            variables.append(f"$add{i}: [ID!]!")
+            fields.append(f"      add{i}: addLabelsToLabelable(input: {{labelableId: $issue{i}, labelIds: $add{i}}}) {{ clientMutationId }}")
+        if kind in "rb":
+            variables.append(f"$remove{i}: [ID!]!")
+            fields.append(f"      remove{i}: removeLabelsFromLabelable(input: {{labelableId: $issue{i}, labelIds: $remove{i}}}) {{ clientMutationId }}")
+    return queries.register(key, """
+    mutation(%s) {
+%s
+    }
+    """ % (", ".join(variables), "\n".join(fields)))
+
+# Change the labels of many issues with one request per batch, returns the errors of each failed issue keyed by issue ID
+def change_labels_in_batch(changes: list, github_token: str) -> dict:
+    changes = sorted(changes, key=lambda change: 1 if change[1] and change[2] else 0 if change[1] else 2)
+    mutation = get_batch_label_mutation(changes)
+    variables = {}
+    for i, (issue_id, add_ids, remove_ids) in enumerate(changes):
+        variables[f"issue{i}"] = issue_id
+        if add_ids:
+            variables[f"add{i}"] = list(add_ids)
+        if remove_ids:
+            variables[f"remove{i}"] = list(remove_ids)
+
+    with metrics.phase('mutate'):
+        result = run_query(mutation, variables, github_token, 'label_changes_batch')
+    failed = {}
+
+    for error in result.get('errors', []):
+        path = error.get('path') or []
+        alias = path[0] if path else ''
+        if alias.startswith('add') or alias.startswith('remove'):
+            issue_id = changes[int(re.sub(r'\D', '', alias))][0]
+            failed.setdefault(issue_id, []).append(error)
+
+    # An error without a path (e.g. a malformed ID) rejects the whole document, so send the batch one by one to find the bad issue
+    if 'errors' in result and not result.get('data') and len(changes) > 1:
+        logging.debug(f"Batch of {len(changes)} label mutations was rejected, retrying them one by one")
+        failed = {}
+        for change in changes:
+            failed.update(change_labels_in_batch([change], github_token))
+        return failed
+
+    if 'errors' in result and not result.get('data'):
+        failed[changes[0][0]] = result['errors']
+
+    label_ids = {issue_id: list(add_ids) + list(remove_ids) for issue_id, add_ids, remove_ids in changes}
+    for issue_id, errors in failed.items():
+        logging.error(f"Error changing the labels of the issue {issue_id}: {errors}")
+        # A NOT_FOUND error means one of the cached IDs is stale, so resolve them again next time
+        if any(error.get('type') == 'NOT_FOUND' for error in errors):
+            id_cache.cache.invalidate_values([issue_id] + label_ids[issue_id])
+    logging.debug(f"Changed the labels of {len(changes) - len(failed)} of {len(changes)} issues in one batch")
+    return failed
+
+# Add labels to many issues with one request per batch, label_requests are (issue ID, label IDs)
+def add_labels_in_batch(label_requests: list, github_token: str) -> dict:
+    return change_labels_in_batch([(issue_id, label_ids, ()) for issue_id, label_ids in label_requests], github_token)
+
+class LabelWriter:
+    # Collects label mutations and sends them batch_size at a time
+    def __init__(self, github_token: str, batch_size: int = LABEL_BATCH_SIZE):
+        self.github_token = github_token
+        self.batch_size = batch_size
+        self.pending = []
+        # Failures since the last flush(), keyed by issue ID
+        self.failed = {}
+
+    def add(self, issue_id: str, label_ids: list):
+        self.change(issue_id, label_ids, ())
+
+    def remove(self, issue_id: str, label_ids: list):
+        self.change(issue_id, (), label_ids)
+
+    # Adding and removing labels of one issue goes in the same batch
+    def change(self, issue_id: str, add_ids: list, remove_ids: list):
+        self.pending.append((issue_id, add_ids, remove_ids))
+        if len(self.pending) >= self.batch_size:
+            self.send(self.batch_size)
+
+    # Send the pending changes in full batches, a shorter last batch only when everything is sent
+    def send(self, minimum: int = 1):
+        while len(self.pending) >= minimum and self.pending:
+            batch = self.pending[:self.batch_size]
+            self.pending = self.pending[self.batch_size:]
+            self.failed.update(change_labels_in_batch(batch, self.github_token))
+
+    # Send what is left and return the failures of this round, a long running process starts the next round empty
+    def flush(self) -> dict:
+        self.send()
+        failed, self.failed = self.failed, {}
+        return failed
 
 def fetch_user_id(login: str, github_token: str) -> str:
-    query = get_user_id_query(login)
-    result = run_query(query, None, github_token)
+    user_id = id_cache.cache.get('user', login)
+    if user_id:
+        return user_id
+
+    with metrics.phase('resolve'):
+        result = run_query(query_user_id, {"login": login}, github_token)
     
     if 'errors' in result:
         logging.error(f"Errors in the query response for user {login}: {result['errors']}")
@@ -434,39 +733,29 @@ def fetch_user_id(login: str, github_token: str) -> str:
 
     user = result['data']['user']
     logging.debug(f"User ID fetched: {user['id']}")
+    id_cache.cache.set('user', login, user['id'])
     return user['id']
 
 def list_issues_without_due_dates(project_number: int, org_name: str, github_token: str) -> list:
-    project_items = fetch_all_project_items(project_number, org_name, github_token)
+    project_items = iter_project_items(project_number, org_name, github_token)
     issues_without_due_dates = []
 
     for item in project_items:
-        content = item.get('content')
-        if content and 'title' in content and 'number' in content:
-            title = content['title']
-            number = content['number']
-            repository = content['repository']['nameWithOwner'].split('/')
-            owner = repository[0]
-            repo = repository[1]
-
-            has_due_date = False
-
-            for field in item.get('fieldValues', {}).get('nodes', []):
-                field_name = sanitize(field.get('field', {}).get('name', ''))
-                if field_name == "DueDate" and field.get('date'):
-                    has_due_date = True
-                    break
-
-            if not has_due_date:
-                issue_owner = content.get('author', {})
-                owner_login = issue_owner.get('login', 'Unknown')
-                issues_without_due_dates.append({
-                    'owner': owner,
-                    'repo': repo,
-                    'number': number,
-                    'title': title,
-                    'author_login': owner_login
-                })
-
-    logging.debug(f"Listed issues without due dates: {issues_without_due_dates}")
+        issue = decode_item(item)
+        if issue and issue.due_date is None:
+            issues_without_due_dates.append({
+                'owner': issue.owner,
+                'repo': issue.repo,
+                'number': issue.number,
+                'title': issue.title,
+                'author_login': issue.author_login,
+                'issue_id': issue.issue_id,
+                'repository_id': issue.repository_id,
+                'author_id': issue.author_id
+            })
+
+    logging.debug("Listed %d issues without due dates of project %s", len(issues_without_due_dates), project_number)
     return issues_without_due_dates
+
+# Label mutations of all rules are queued here and sent in batches
+label_writer = LabelWriter(github_token)
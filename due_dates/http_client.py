@@ -0,0 +1,236 @@
+#This script holds the shared HTTP client, every request to GitHub, Slack and Otsimo goes through it so connections are pooled and kept alive
+import os
+import re
+import gzip
+import json
+import time
+import atexit
+import hashlib
+import logging
+import threading
+import requests
+import metrics
+from urllib.parse import urlparse, urlencode
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Pool and retry settings can be changed from the environment
+POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 10))
+POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 10))
+MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 3))
+BACKOFF_FACTOR = float(os.environ.get('HTTP_BACKOFF_FACTOR', 0.5))
+TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', 30))
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# Methods that can be sent again without side effects, other calls are only retried when they surely did not arrive
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+# Record every call into a cassette file, or replay the calls from one without touching the network
+CASSETTE_MODE = os.environ.get('HTTP_CASSETTE_MODE', '')
+CASSETTE_PATH = os.environ.get('HTTP_CASSETTE', 'cassette.json.gz')
+# Simulated latency of a replayed call in milliseconds, "recorded" waits as long as the recorded call took
+REPLAY_LATENCY = os.environ.get('HTTP_REPLAY_LATENCY', '')
+
+# Tokens of GitHub, Slack and bearer headers never end up in a cassette
+TOKEN_PATTERNS = re.compile(r'gh[pousr]_[A-Za-z0-9]{20,}|github_pat_[A-Za-z0-9_]{20,}|xox[abpr]-[A-Za-z0-9-]+|Bearer [A-Za-z0-9._~+/=-]+')
+# Response headers the scripts read, the rest is not recorded
+RECORDED_HEADERS = ('content-type', 'etag', 'last-modified', 'retry-after', 'x-ratelimit-remaining', 'x-ratelimit-reset',
+                    'x-ratelimit-resource', 'x-ratelimit-used', 'x-ratelimit-limit')
+
+def scrub(text: str) -> str:
+    return TOKEN_PATTERNS.sub('<scrubbed>', text)
+
+class CassetteMiss(requests.ConnectionError):
+    pass
+
+class Cassette:
+    # Calls are matched by method, URL and a hash of the body, calls with the same key are replayed in the recorded order
+    def __init__(self, path: str, mode: str, latency: str = REPLAY_LATENCY):
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.interactions = {}
+        if mode == 'replay':
+            with gzip.open(path, 'rt') as f:
+                for interaction in json.load(f):
+                    self.interactions.setdefault(interaction['key'], []).append(interaction)
+            self.played = {key: 0 for key in self.interactions}
+
+    @staticmethod
+    def key(method: str, url: str, kwargs: dict) -> str:
+        if kwargs.get('params'):
+            url += ('&' if '?' in url else '?') + urlencode(sorted(kwargs['params'].items()))
+        body = kwargs.get('json')
+        if body is None and kwargs.get('data') is not None:
+            body = kwargs['data']
+            if isinstance(body, bytes):
+                body = body.decode()
+            try:
+                body = json.loads(body)
+            except (TypeError, ValueError):
+                pass
+        # JSON bodies are compared by content, so the key does not depend on how they were serialized
+        canonical = json.dumps(body, sort_keys=True, separators=(',', ':')) if body is not None else ''
+        return f"{method} {scrub(url)} {hashlib.sha1(scrub(canonical).encode()).hexdigest()[:16]}"
+
+    def record(self, method: str, url: str, kwargs: dict, response: requests.Response, duration: float):
+        interaction = {
+            'key': self.key(method, url, kwargs),
+            'status': response.status_code,
+            'headers': {name: value for name, value in response.headers.items() if name.lower() in RECORDED_HEADERS},
+            'body': scrub(response.text),
+            'duration_ms': round(duration * 1000, 1)
+        }
+        with self.lock:
+            self.interactions.setdefault(interaction['key'], []).append(interaction)
+
+    def replay(self, method: str, url: str, kwargs: dict) -> requests.Response:
+        key = self.key(method, url, kwargs)
+        with self.lock:
+            recorded = self.interactions.get(key)
+            if not recorded:
+                raise CassetteMiss(f"No recorded call for {method} {url} in {self.path}")
+            # Once the recorded calls of a key run out, the last one is played again
+            interaction = recorded[min(self.played[key], len(recorded) - 1)]
+            self.played[key] += 1
+
+        if self.latency == 'recorded':
+            time.sleep(interaction['duration_ms'] / 1000)
+        elif self.latency:
+            time.sleep(float(self.latency) / 1000)
+
+        response = requests.Response()
+        response.status_code = interaction['status']
+        response.headers.update(interaction['headers'])
+        response._content = interaction['body'].encode()
+        response.encoding = 'utf-8'
+        response.url = url
+        response.raw = None
+        return response
+
+    # The cassette is written once at exit, gzip keeps the repeated GraphQL responses small
+    def save(self):
+        if self.mode != 'record':
+            return
+        with self.lock:
+            interactions = [interaction for recorded in self.interactions.values() for interaction in recorded]
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with gzip.open(self.path + '.tmp', 'wt') as f:
+            json.dump(interactions, f, separators=(',', ':'))
+        os.replace(self.path + '.tmp', self.path)
+        logging.info(f"Recorded {len(interactions)} calls to {self.path}")
+
+class HttpClient:
+    def __init__(self, pool_connections: int = POOL_CONNECTIONS, pool_maxsize: int = POOL_MAXSIZE,
+                 max_retries: int = MAX_RETRIES, backoff_factor: float = BACKOFF_FACTOR, timeout: float = TIMEOUT,
+                 cassette: Cassette = None):
+        # pool_connections is the number of hosts kept in the pool, pool_maxsize is the number of keep-alive connections per host
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=None,  # GraphQL queries go over POST, so POST is retried too
+            raise_on_status=False
+        )
+        # Writes (Slack messages, mutations, createLabel) may have been done even if the answer was lost,
+        # so they are only sent again when the connection could not be made or the server said 429 before doing anything
+        write_retry = Retry(
+            total=max_retries,
+            read=0,
+            other=0,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429,),
+            allowed_methods=None,
+            raise_on_status=False
+        )
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.write_adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=write_retry)
+        self.session = self.make_session(self.adapter)
+        self.write_session = self.make_session(self.write_adapter)
+        self.timeout = timeout
+        self.cassette = cassette
+
+    @staticmethod
+    def make_session(adapter: HTTPAdapter) -> requests.Session:
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers['Connection'] = 'keep-alive'
+        return session
+
+    # Every call is recorded as a span named span_name (the URL path by default), the span is attached to the response
+    # idempotent tells whether the call can be retried on any error, by default only for the IDEMPOTENT_METHODS,
+    # e.g. a GraphQL query is a POST that passes idempotent=True
+    def request(self, method: str, url: str, span_name: str = None, idempotent: bool = None, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        session = self.session if idempotent else self.write_session
+        span = metrics.start_span(span_name or urlparse(url).path)
+        started = time.time()
+        try:
+            if self.cassette is not None and self.cassette.mode == 'replay':
+                response = self.cassette.replay(method, url, kwargs)
+            else:
+                response = session.request(method, url, **kwargs)
+        except Exception:
+            span.finish('error')
+            raise
+        if self.cassette is not None and self.cassette.mode == 'record':
+            self.cassette.record(method, url, kwargs, response, time.time() - started)
+        retries = response.raw.retries.history if response.raw is not None and getattr(response.raw, 'retries', None) else ()
+        span.finish(response.status_code, len(response.content), len(retries))
+        response.span = span
+        return response
+
+    def get(self, url: str, span_name: str = None, **kwargs) -> requests.Response:
+        return self.request('GET', url, span_name, **kwargs)
+
+    def post(self, url: str, span_name: str = None, idempotent: bool = False, **kwargs) -> requests.Response:
+        return self.request('POST', url, span_name, idempotent, **kwargs)
+
+    def connection_stats(self) -> dict:
+        # urllib3 keeps a pool per host, each pool counts the requests it served and the connections it had to open
+        requests_count = 0
+        connections_count = 0
+        for adapter in (self.adapter, self.write_adapter):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                requests_count += pool.num_requests
+                connections_count += pool.num_connections
+        reuse_ratio = 1 - connections_count / requests_count if requests_count else 0.0
+        return {
+            'requests': requests_count,
+            'connections': connections_count,
+            'reuse_ratio': reuse_ratio
+        }
+
+    def log_stats(self):
+        stats = self.connection_stats()
+        if stats['requests']:
+            logging.info(f"HTTP requests: {stats['requests']}, connections opened: {stats['connections']}, "
+                         f"connection reuse ratio: {stats['reuse_ratio']:.2%}")
+
+    def close(self):
+        self.session.close()
+        self.write_session.close()
+
+# Shared client used by all scripts
+client = HttpClient(cassette=Cassette(CASSETTE_PATH, CASSETTE_MODE) if CASSETTE_MODE in ('record', 'replay') else None)
+atexit.register(client.log_stats)
+if client.cassette is not None:
+    atexit.register(client.cassette.save)
+
+def get(url: str, span_name: str = None, **kwargs) -> requests.Response:
+    return client.get(url, span_name, **kwargs)
+
+def post(url: str, span_name: str = None, idempotent: bool = False, **kwargs) -> requests.Response:
+    return client.post(url, span_name, idempotent, **kwargs)
+
+def request(method: str, url: str, span_name: str = None, **kwargs) -> requests.Response:
+    return client.request(method, url, span_name, **kwargs)
@@ -0,0 +1,98 @@
+#This script keeps the GitHub node IDs (repositories, issues, labels, users) between runs in SQLite with a small in-memory LRU in front of it.
+import os
+import time
+import sqlite3
+import logging
+import atexit
+import threading
+from collections import OrderedDict
+from script import get_cache_dir
+
+DAY = 24 * 60 * 60
+
+# Time to live of each kind of ID in seconds, None means the entry never expires
+TTLS = {
+    'repository': 30 * DAY,
+    'issue': 30 * DAY,
+    'label': 7 * DAY,
+    'user': 30 * DAY,
+    # Date an issue was moved to Done, a past transition does not change
+    'done_date': None
+}
+
+MEMORY_SIZE = int(os.environ.get('ID_CACHE_MEMORY_SIZE', 10000))
+
+class IdCache:
+    def __init__(self, path: str, ttls: dict = TTLS, memory_size: int = MEMORY_SIZE):
+        self.ttls = dict(ttls)
+        self.memory_size = memory_size
+        self.memory = OrderedDict()
+        self.hits = {}
+        self.misses = {}
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS ids (kind TEXT, key TEXT, value TEXT, expires_at REAL, PRIMARY KEY (kind, key))")
+        self.db.execute("CREATE INDEX IF NOT EXISTS ids_value ON ids (value)")
+        self.db.commit()
+
+    def get(self, kind: str, key: str):
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get((kind, key))
+            if entry is None:
+                row = self.db.execute("SELECT value, expires_at FROM ids WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+                if row is not None:
+                    entry = (row[0], row[1])
+                    self._remember(kind, key, entry)
+            else:
+                self.memory.move_to_end((kind, key))
+
+            if entry is None or (entry[1] is not None and entry[1] < now):
+                self.misses[kind] = self.misses.get(kind, 0) + 1
+                return None
+
+            self.hits[kind] = self.hits.get(kind, 0) + 1
+            return entry[0]
+
+    def set(self, kind: str, key: str, value: str):
+        ttl = self.ttls.get(kind)
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self.lock:
+            self._remember(kind, key, (value, expires_at))
+            self.db.execute("INSERT OR REPLACE INTO ids (kind, key, value, expires_at) VALUES (?, ?, ?, ?)", (kind, key, value, expires_at))
+            self.db.commit()
+
+    def invalidate(self, kind: str, key: str):
+        with self.lock:
+            self.memory.pop((kind, key), None)
+            self.db.execute("DELETE FROM ids WHERE kind = ? AND key = ?", (kind, key))
+            self.db.commit()
+
+    # Drop every entry pointing to one of the given node IDs, used when a mutation says the node is not found
+    def invalidate_values(self, values: list):
+        values = set(values)
+        with self.lock:
+            for cache_key in [cache_key for cache_key, entry in self.memory.items() if entry[0] in values]:
+                del self.memory[cache_key]
+            self.db.executemany("DELETE FROM ids WHERE value = ?", [(value,) for value in values])
+            self.db.commit()
+        logging.debug(f"Invalidated cached IDs: {values}")
+
+    def _remember(self, kind: str, key: str, entry: tuple):
+        self.memory[(kind, key)] = entry
+        self.memory.move_to_end((kind, key))
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {kind: {'hits': self.hits.get(kind, 0), 'misses': self.misses.get(kind, 0)}
+                for kind in set(self.hits) | set(self.misses)}
+
+    def log_stats(self):
+        stats = self.stats()
+        if stats:
+            logging.info(f"ID cache hits and misses: {stats}")
+
+# Shared cache used by all the ID resolvers
+cache = IdCache(os.path.join(get_cache_dir(), 'ids.sqlite3'))
+atexit.register(cache.log_stats)
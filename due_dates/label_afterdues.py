@@ -1,195 +1,176 @@
 #This scripts finds issues which are marked 'Done' after its due date and labels them with 'Resolved Late' label.
+import os
 import datetime
 import github_utils
-import re
+import id_cache
+import metrics
+import queries
+from project_item import ProjectItem, Status, decode_item, status_of
+import rule_engine
+import label_planner
 import logging
-import requests
+
+# An issue is resolved late if it is not in the backlog, marked as done and its due date has passed
+def is_resolved_late(issue: ProjectItem, project: dict) -> bool:
+    if "Backlog" in issue.labels or issue.due_date is None:
+        return False
+    return issue.is_done and issue.due_date < datetime.datetime.now().date()
 
 def list_past_due_issues(project_number: int, org_name: str, github_token: str) -> list:
     #Fetch issues from the project and identify those that are resolved after their due dates.
-    project_items = github_utils.fetch_all_project_items(project_number, org_name, github_token)
-    current_date = datetime.datetime.now().date()
+    project_items = github_utils.iter_project_items(project_number, org_name, github_token)
     past_due_issues = []
 
     for item in project_items:
-        content = item.get('content')
-        if content and 'title' in content and 'number' in content:
-            title = content['title']
-            number = content['number']
-            labels = [label['name'] for label in content['labels']['nodes']]
-            repository = content['repository']['nameWithOwner'].split('/')
-            owner = repository[0]
-            repo = repository[1]
-
-            # Skip if the issue has a "Backlog" label
-            if "Backlog" in labels:
-                continue
-
-            has_due_date = False
-            is_done = False
-            due_date = None
-
-            # Loop through the fieldValues to find due date and status
-            for field in item.get('fieldValues', {}).get('nodes', []):
-                field_name = github_utils.sanitize(field.get('field', {}).get('name', ''))
-                field_value = github_utils.sanitize(field.get('name', ''))
-
-                # Check if the field is "DueDate"
-                if field_name == "DueDate" and field.get('date'):
-                    has_due_date = True
-                    due_date = datetime.datetime.strptime(field.get('date'), '%Y-%m-%d').date()
-                # Check if the status is "Done"
-                if field_name == "Status" and re.search(r'done', field_value, re.IGNORECASE):
-                    is_done = True
-
-
-            # If the issue is marked as done and the due date is in the past
-            if has_due_date and is_done:
-                if due_date < current_date:
-                    # Since the status is found as "Done", append the issue to past due issues
-                    past_due_issues.append({
-                        'owner': owner,
-                        'repo': repo,
-                        'number': number,
-                        'title': title,
-                        'due_date': due_date
-                    })
-
-    logging.debug(f"Listed past due issues: {past_due_issues}")
+        issue = decode_item(item)
+        if issue and is_resolved_late(issue, None):
+            past_due_issues.append({
+                'owner': issue.owner,
+                'repo': issue.repo,
+                'number': issue.number,
+                'title': issue.title,
+                'due_date': issue.due_date,
+                'issue_id': issue.issue_id,
+                'repository_id': issue.repository_id,
+                'author_id': issue.author_id
+            })
+
+    logging.debug("Listed %d issues resolved late of project %s", len(past_due_issues), project_number)
     return past_due_issues
 
-def get_done_status_timestamp(owner: str, repo: str, issue_number: int, github_token: str) -> datetime.date:
-    """
-    Fetch the timeline of the issue and check when it was marked 'done' based on the status change.
-    """
-    query = """
-    query($owner: String!, $repo: String!, $issue_number: Int!) {
-      repository(owner: $owner, name: $repo) {
-        issue(number: $issue_number) {
-          timelineItems(first: 100, itemTypes: [PROJECT_CARD, CROSS_REFERENCED_EVENT, PROJECT_V2_ITEM_FIELD_VALUE_CHANGED_EVENT]) {
-            nodes {
-              __typename
-              ... on ProjectV2ItemFieldValueChangedEvent {
-                field {
-                  name
-                }
-                projectV2Item {
-                  content {
-                    ... on Issue {
-                      number
-                      title
-                    }
-                  }
-                }
-                value
-                createdAt
-              }
+# Number of issues whose timelines are fetched in one query
+TIMELINE_BATCH_SIZE = int(os.environ.get('TIMELINE_BATCH_SIZE', 50))
+
+TIMELINE_SELECTION = """
+      timelineItems(last: 100, before: $before, itemTypes: [PROJECT_CARD, CROSS_REFERENCED_EVENT, PROJECT_V2_ITEM_FIELD_VALUE_CHANGED_EVENT]) {
+        pageInfo {
+          hasPreviousPage
+          startCursor
+        }
+        nodes {
+          __typename
+          ... on ProjectV2ItemFieldValueChangedEvent {
+            field {
+              name
             }
+            value
+            createdAt
           }
         }
-      }
-    }
-    """
-    variables = {
-        "owner": owner,
-        "repo": repo,
-        "issue_number": issue_number
+      }"""
+
+# The latest events of many issues in one query, the Done transition is almost always among them
+query_issue_timelines = queries.register('issue_timelines', """
+query($ids: [ID!]!, $before: String) {
+  nodes(ids: $ids) {
+    ... on Issue {
+      id%s
     }
-    headers = {
-        'Authorization': f'Bearer {github_token}',
-        'Content-Type': 'application/json'
+  }
+}
+""" % TIMELINE_SELECTION)
+
+# Earlier events of one issue, only for the timelines longer than one page
+query_issue_timeline = queries.register('issue_timeline', """
+query($id: ID!, $before: String) {
+  node(id: $id) {
+    ... on Issue {
+      id%s
     }
+  }
+}
+""" % TIMELINE_SELECTION)
+
+# Date of the last change of the Status field to a Done option in the events, None if there is none
+def find_done_date(events: list) -> datetime.date:
+    for event in reversed(events):
+        if event.get('__typename') != 'ProjectV2ItemFieldValueChangedEvent':
+            continue
+        field_name = (event.get('field') or {}).get('name', '').lower()
+        if field_name == 'status' and status_of(event.get('value') or '') is Status.DONE:
+            return datetime.datetime.strptime(event['createdAt'], '%Y-%m-%dT%H:%M:%SZ').date()
+    return None
 
-    response = requests.post('https://api.github.com/graphql', json={'query': query, 'variables': variables}, headers=headers)
+# Fetch the dates the issues were marked 'Done', keyed by issue ID, issues that were never marked Done are left out
+def fetch_done_dates(issue_ids: list, github_token: str) -> dict:
+    done_dates = {}
+    missing = []
+    for issue_id in dict.fromkeys(issue_ids):
+        cached = id_cache.cache.get('done_date', issue_id)
+        if cached:
+            done_dates[issue_id] = datetime.date.fromisoformat(cached)
+        else:
+            missing.append(issue_id)
+
+    for i in range(0, len(missing), TIMELINE_BATCH_SIZE):
+        batch = missing[i:i + TIMELINE_BATCH_SIZE]
+        with metrics.phase('resolve'):
+            result = github_utils.run_query(query_issue_timelines, {"ids": batch}, github_token)
+        if not result.get('data'):
+            logging.error(f"Could not fetch the timelines of {len(batch)} issues: {result.get('errors')}")
+            continue
 
-    if response.status_code == 200:
-        result = response.json()
-        timeline_items = result['data']['repository']['issue']['timelineItems']['nodes']
+        for node in result['data']['nodes']:
+            if not node or 'timelineItems' not in node:
+                continue
+            timeline = node['timelineItems']
+            done_date = find_done_date(timeline['nodes'])
+            # Page back through the longer timelines until a Done transition is found
+            while done_date is None and timeline['pageInfo']['hasPreviousPage']:
+                variables = {
+                    "id": node['id'],
+                    "before": timeline['pageInfo']['startCursor']
+                }
+                with metrics.phase('resolve'):
+                    page = github_utils.run_query(query_issue_timeline, variables, github_token)
+                if not page.get('data') or not page['data']['node']:
+                    break
+                timeline = page['data']['node']['timelineItems']
+                done_date = find_done_date(timeline['nodes'])
 
-        # Look for the event where the Status is changed to "Done"
-        for event in timeline_items:
-            if event.get('__typename') == 'ProjectV2ItemFieldValueChangedEvent':
-                field_name = event['field'].get('name', '').lower()
-                field_value = event.get('value', '').lower()
-                # Check if the field is "Status" and if the value is "done"
-                if field_name == 'status' and 'done' in field_value:
-                    done_timestamp = event['createdAt']
-                    done_date = datetime.datetime.strptime(done_timestamp, '%Y-%m-%dT%H:%M:%SZ').date()
-                    return done_date
+            if done_date is not None:
+                done_dates[node['id']] = done_date
+                id_cache.cache.set('done_date', node['id'], done_date.isoformat())
 
-    return None
+    logging.debug(f"Found the done dates of {len(done_dates)} of {len(issue_ids)} issues, {len(missing)} were not cached")
+    return done_dates
+
+def get_done_status_timestamp(issue_id: str, github_token: str) -> datetime.date:
+    """
+    Fetch the timeline of the issue and check when it was marked 'done' based on the status change.
+    """
+    return fetch_done_dates([issue_id], github_token).get(issue_id)
+
+# Done issues past their due date, their timelines are fetched together after the crawl
+candidates = []
+
+def queue_resolved_late_check(issue: ProjectItem, project: dict, label_name: str = "Resolved Late"):
+    # Issues that already have the label need no timeline
+    if label_name not in issue.labels:
+        candidates.append((issue, project, label_name))
+
+# An issue is labeled if it was marked Done after its due date, or if the date it was marked Done is unknown
+def label_resolved_late():
+    # Pages arrive in any order in a concurrent crawl, sorting keeps the timeline batches the same from run to run
+    candidates.sort(key=lambda candidate: candidate[0].issue_id or '')
+    done_dates = fetch_done_dates([issue.issue_id for issue, project, label_name in candidates if issue.issue_id], github_utils.github_token)
+    for issue, project, label_name in candidates:
+        done_date = done_dates.get(issue.issue_id)
+        if done_date is None or done_date > issue.due_date:
+            label_planner.planner.want(issue, label_name)
+        else:
+            logging.debug(f"Issue {issue.number} in {issue.repo} was done on {done_date}, before its due date {issue.due_date}")
+    candidates.clear()
+
+rule = rule_engine.Rule('resolved_late', is_resolved_late, queue_resolved_late_check, label_resolved_late,
+                        needs={'labels', 'due_date', 'status'}, label='Resolved Late')
 
-def get_or_create_label(org_name: str, repo_name: str, repository_id: str, github_token: str, label_name:str) -> str:
-    label_query = '''
-    query($organization: String!, $repo: String!, $name: String!) {
-      organization(login: $organization) {
-        repository(name: $repo) {
-          label(name: $name) {
-            id
-          }
-        }
-      }
-    }
-    '''
-    label_variables = {
-        "organization": org_name,
-        "repo": repo_name,
-        "name": label_name
-    }
-    label_data = github_utils.run_query(label_query, label_variables, github_token)
-    label_info = label_data['data']['organization']['repository']['label']
-    if label_info is None:
-        create_label_mutation = '''
-        mutation($repositoryId: ID!, $name: String!, $color: String!, $description: String) {
-          createLabel(input: {repositoryId: $repositoryId, name: $name, color: $color, description: $description}) {
-            label {
-              id
-              name
-            }
-          }
-        }
-        '''
-        label_variables = {
-            "repositoryId": repository_id,
-            "name": "Resolved Late",
-            "color": "E67E22",  # Burnt orange color for "Resolved Late" label
-            "description": "This issue is resolved after due date."
-        }
-        label_data = github_utils.run_query(create_label_mutation, label_variables, github_token)
-        logging.debug(f"Label created: {label_data['data']['createLabel']['label']['id']}")
-        return label_data['data']['createLabel']['label']['id']
-    else:
-        logging.debug(f"Label ID fetched: {label_info['id']}")
-        return label_info['id']
-    
 def label_past_due_issues(org_name: str, github_token: str, label_name: str = "Resolved Late"):
     # Fetch all open projects, find issues resolved after their due date, and label them.
-    # Fetch open projects
-    projects = github_utils.fetch_projects(org_name, github_token)
-
-    for project in projects:
-        project_details = github_utils.fetch_project_details(project['id'], github_token)
-
-        # If the project is closed, skip it
-        if project_details['closed']:
-            continue
-        
-        # Get the project number and list all issues past due date and marked as done
-        past_due_issues = list_past_due_issues(project_details['number'], org_name, github_token)
-        # Label those past due issues as "Resolved Late"
-        for issue in past_due_issues:
-            repo_owner = issue['owner']
-            repo_name = issue['repo']
-            issue_number = issue['number']
-            issue_id = github_utils.get_issue_id(org_name, repo_name, issue_number, github_token)
-            repository_id = github_utils.get_repository_id(org_name, repo_name, github_token)
-            if repository_id is None:
-                continue
-            logging.debug(f"Repository ID: {repository_id}")
-
-            label_id = get_or_create_label(org_name, repo_name, repository_id, github_token, label_name)
-            github_utils.add_label_to_issue(issue_id, label_id, github_token)
-            logging.debug(f'{label_name} Label is added to the issue {issue_number} in {repo_name}')
+    label_rule = rule_engine.Rule('resolved_late', is_resolved_late,
+                                  lambda issue, project: queue_resolved_late_check(issue, project, label_name),
+                                  label_resolved_late, needs={'labels', 'due_date', 'status'}, label=label_name)
+    rule_engine.run_rules([label_rule], org_name, github_token)
 
 def main():
     GITHUB_TOKEN = github_utils.github_token
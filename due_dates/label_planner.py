@@ -0,0 +1,104 @@
+#This script collects the labels the rules want on each issue, compares them with the labels the crawl saw and sends only the differences.
+import math
+import logging
+import github_utils
+import id_cache
+
+class LabelPlan:
+    def __init__(self, issue):
+        self.issue = issue
+        # Label name -> whether any item of the issue wants it, an issue can be in several projects
+        self.wanted = {}
+
+    # The differences are taken once all items of the issue were evaluated
+    @property
+    def add(self) -> set:
+        return {label_name for label_name, present in self.wanted.items() if present and label_name not in self.issue.labels}
+
+    @property
+    def remove(self) -> set:
+        return {label_name for label_name, present in self.wanted.items() if not present and label_name in self.issue.labels}
+
+class LabelPlanner:
+    def __init__(self):
+        # Issue ID -> LabelPlan
+        self.plans = {}
+
+    # A rule says whether it wants the label on the issue, the label is kept or added if any item of the issue wants it
+    def want(self, issue, label_name: str, present: bool = True):
+        # A label the issue does not have can only be added, so not wanting it changes nothing
+        if issue.issue_id is None or issue.repository_id is None or not (present or label_name in issue.labels):
+            return
+        plan = self.plans.get(issue.issue_id)
+        if plan is None:
+            plan = self.plans[issue.issue_id] = LabelPlan(issue)
+        plan.wanted[label_name] = plan.wanted.get(label_name, False) or present
+
+    # Labels whose IDs are not cached yet, each of them costs a lookup (and a createLabel if it does not exist)
+    def uncached_labels(self) -> set:
+        labels = set()
+        for plan in self.plans.values():
+            issue = plan.issue
+            for label_name in plan.add | plan.remove:
+                if id_cache.cache.get('label', f"{issue.owner}/{issue.repo}:{label_name}") is None:
+                    labels.add((issue.owner, issue.repo, label_name))
+        return labels
+
+    def projected_calls(self) -> dict:
+        changes = [plan for plan in self.plans.values() if plan.add or plan.remove]
+        return {
+            'label_lookups': len(self.uncached_labels()),
+            'mutation_batches': math.ceil(len(changes) / github_utils.LABEL_BATCH_SIZE)
+        }
+
+    def print_plan(self):
+        additions = 0
+        removals = 0
+        changed = 0
+        for plan in sorted(self.plans.values(), key=lambda plan: (plan.issue.owner, plan.issue.repo, plan.issue.number)):
+            add, remove = plan.add, plan.remove
+            if not add and not remove:
+                continue
+            changes = [f"+{label}" for label in sorted(add)] + [f"-{label}" for label in sorted(remove)]
+            print(f"{plan.issue.owner}/{plan.issue.repo}#{plan.issue.number}: {', '.join(changes)}")
+            additions += len(add)
+            removals += len(remove)
+            changed += 1
+        calls = self.projected_calls()
+        print(f"{additions} labels to add and {removals} to remove on {changed} issues")
+        print(f"Projected API calls: {calls['label_lookups']} label lookups, {calls['mutation_batches']} mutation batches")
+        self.plans.clear()
+
+    # Resolve the label IDs and send one change per issue, returns the errors of each failed issue keyed by issue ID
+    # Plans are sent in issue ID order, so the label batches do not depend on the order the pages arrived in
+    def apply(self, github_token: str) -> dict:
+        # A label that could not be resolved is not asked for again for every issue of the repository
+        label_ids = {}
+
+        def label_id(issue, label_name: str) -> str:
+            key = (issue.owner, issue.repo, label_name)
+            if key not in label_ids:
+                label_ids[key] = github_utils.get_or_create_label_id(issue.owner, issue.repo, issue.repository_id, github_token, label_name)
+            return label_ids[key]
+
+        skipped = {}
+        for issue_id, plan in sorted(self.plans.items()):
+            issue = plan.issue
+            add, remove = sorted(plan.add), sorted(plan.remove)
+            add_ids = [label_id(issue, label_name) for label_name in add]
+            remove_ids = [label_id(issue, label_name) for label_name in remove]
+            # One issue whose label cannot be resolved does not stop the labels of the others
+            if None in add_ids or None in remove_ids:
+                logging.error(f"Skipping the labels of issue {issue.number} in {issue.repo}: add {add}, remove {remove}")
+                skipped[issue_id] = [{'message': 'A label of the issue could not be resolved'}]
+                continue
+            if add_ids or remove_ids:
+                github_utils.label_writer.change(issue.issue_id, add_ids, remove_ids)
+                logging.debug(f"Labels of issue {issue.number} in {issue.repo}: add {add}, remove {remove}")
+        self.plans.clear()
+        failed = github_utils.label_writer.flush()
+        failed.update(skipped)
+        return failed
+
+# Label wishes of all rules are collected here during a run
+planner = LabelPlanner()
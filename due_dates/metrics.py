@@ -0,0 +1,140 @@
+#This script records a span for every API call of a run and exports them as a Prometheus textfile and a JSON trace when the run ends.
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from script import get_cache_dir
+
+# Name of the run, it names the exported files and is the run label of every series, so the files of different
+# scripts or daemon jobs in one METRICS_DIR do not overwrite each other
+run_name = os.environ.get('METRICS_NAME', 'due_dates')
+
+# Phase of the run the current call belongs to: catalog, crawl, resolve, mutate or notify
+current_phase = contextvars.ContextVar('current_phase', default='other')
+
+class Span:
+    def __init__(self, name: str, phase: str):
+        self.name = name
+        self.phase = phase
+        self.start = time.time()
+        self.duration = None
+        self.status = None
+        self.response_bytes = 0
+        self.cost = None
+        self.retries = 0
+
+    def finish(self, status, response_bytes: int = 0, retries: int = 0):
+        self.duration = time.time() - self.start
+        self.status = status
+        self.response_bytes = response_bytes
+        self.retries = retries
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'phase': self.phase,
+            'start': self.start,
+            'duration_ms': round(self.duration * 1000, 3) if self.duration is not None else None,
+            'status': self.status,
+            'response_bytes': self.response_bytes,
+            'cost': self.cost,
+            'retries': self.retries
+        }
+
+run_started = time.time()
+spans = []
+spans_lock = threading.Lock()
+
+def start_span(name: str) -> Span:
+    span = Span(name, current_phase.get())
+    with spans_lock:
+        spans.append(span)
+    return span
+
+@contextmanager
+def phase(name: str):
+    token = current_phase.set(name)
+    try:
+        yield
+    finally:
+        current_phase.reset(token)
+
+def quantile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def prometheus_text(finished_spans: list, name: str = 'due_dates') -> str:
+    groups = {}
+    for span in finished_spans:
+        groups.setdefault((span.name, span.phase), []).append(span)
+
+    lines = [
+        "# HELP due_dates_requests_total API calls made by the run.",
+        "# TYPE due_dates_requests_total counter"
+    ]
+    statuses = {}
+    for span in finished_spans:
+        key = (span.name, span.phase, span.status)
+        statuses[key] = statuses.get(key, 0) + 1
+    for (query_name, phase_name, status), count in sorted(statuses.items(), key=str):
+        lines.append(f'due_dates_requests_total{{run="{name}",query="{query_name}",phase="{phase_name}",status="{status}"}} {count}')
+
+    lines += [
+        "# HELP due_dates_request_duration_seconds Latency of the API calls.",
+        "# TYPE due_dates_request_duration_seconds summary"
+    ]
+    for (query_name, phase_name), group in sorted(groups.items()):
+        durations = sorted(span.duration for span in group)
+        labels = f'run="{name}",query="{query_name}",phase="{phase_name}"'
+        for q in (0.5, 0.95):
+            lines.append(f'due_dates_request_duration_seconds{{{labels},quantile="{q}"}} {quantile(durations, q):.6f}')
+        lines.append(f'due_dates_request_duration_seconds_sum{{{labels}}} {sum(durations):.6f}')
+        lines.append(f'due_dates_request_duration_seconds_count{{{labels}}} {len(durations)}')
+
+    for metric, help_text, attribute in (
+        ('due_dates_response_bytes_total', 'Bytes received from the APIs.', 'response_bytes'),
+        ('due_dates_graphql_cost_total', 'GraphQL rate limit points spent.', 'cost'),
+        ('due_dates_retries_total', 'Retries made by the HTTP client.', 'retries')
+    ):
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        for (query_name, phase_name), group in sorted(groups.items()):
+            total = sum(getattr(span, attribute) or 0 for span in group)
+            lines.append(f'{metric}{{run="{name}",query="{query_name}",phase="{phase_name}"}} {total}')
+
+    return "\n".join(lines) + "\n"
+
+# Write the metrics of the run to <name>.prom and <name>.trace.json, the files are replaced atomically so a collector never reads half a file
+def export(metrics_dir: str = None, name: str = None):
+    name = name or run_name
+    with spans_lock:
+        finished_spans = [span for span in spans if span.duration is not None]
+    if not finished_spans:
+        return
+    metrics_dir = metrics_dir or os.environ.get('METRICS_DIR', os.path.join(get_cache_dir(), 'metrics'))
+    os.makedirs(metrics_dir, exist_ok=True)
+
+    prometheus_path = os.path.join(metrics_dir, f'{name}.prom')
+    with open(prometheus_path + '.tmp', 'w') as f:
+        f.write(prometheus_text(finished_spans, name))
+    os.replace(prometheus_path + '.tmp', prometheus_path)
+
+    trace_path = os.path.join(metrics_dir, f'{name}.trace.json')
+    with open(trace_path + '.tmp', 'w') as f:
+        json.dump({'run': name, 'run_started': run_started, 'spans': [span.to_dict() for span in finished_spans]}, f)
+    os.replace(trace_path + '.tmp', trace_path)
+
+    logging.info(f"Exported metrics of {len(finished_spans)} API calls to {metrics_dir}")
+
+# Start a new run in the same process, e.g. the next job of the daemon
+def reset():
+    global run_started
+    with spans_lock:
+        spans.clear()
+        run_started = time.time()
+
+atexit.register(export)
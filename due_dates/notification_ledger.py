@@ -0,0 +1,70 @@
+#This script remembers which notifications were sent, so a user is reminded of the same issue again only after an interval and not on every run.
+import os
+import time
+import sqlite3
+import logging
+import threading
+from script import get_cache_dir
+
+HOUR = 60 * 60
+
+# Hours before the same notification is sent again, RENOTIFY_INTERVAL_HOURS_<RULE> overrides it for one rule
+RENOTIFY_INTERVAL = float(os.environ.get('RENOTIFY_INTERVAL_HOURS', 72)) * HOUR
+
+# SQLite allows 999 parameters in one statement
+QUERY_CHUNK_SIZE = 500
+
+def renotify_interval(rule: str) -> float:
+    hours = os.environ.get(f'RENOTIFY_INTERVAL_HOURS_{rule.upper()}')
+    return float(hours) * HOUR if hours else RENOTIFY_INTERVAL
+
+class NotificationLedger:
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS notifications (rule TEXT, issue_id TEXT, recipient TEXT, sent_at REAL, "
+                        "PRIMARY KEY (rule, issue_id, recipient))")
+        self.db.commit()
+        # Issues that stopped offending a rule in this run, keyed by rule, deleted together by flush_compliant
+        self.compliant = {}
+
+    # keys are (rule, issue ID, recipient), returns the keys that were never sent or whose interval has passed
+    def due(self, keys: list, now: float = None) -> list:
+        now = now if now is not None else time.time()
+        sent_at = {}
+        issue_ids = sorted({issue_id for _, issue_id, _ in keys})
+        with self.lock:
+            for i in range(0, len(issue_ids), QUERY_CHUNK_SIZE):
+                chunk = issue_ids[i:i + QUERY_CHUNK_SIZE]
+                rows = self.db.execute(
+                    "SELECT rule, issue_id, recipient, sent_at FROM notifications WHERE issue_id IN (%s)" % ",".join("?" * len(chunk)),
+                    chunk)
+                for rule, issue_id, recipient, sent in rows:
+                    sent_at[(rule, issue_id, recipient)] = sent
+        due_keys = [key for key in keys if key not in sent_at or now - sent_at[key] >= renotify_interval(key[0])]
+        logging.debug(f"{len(due_keys)} of {len(keys)} notifications are due")
+        return due_keys
+
+    def record(self, keys: list, now: float = None):
+        now = now if now is not None else time.time()
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO notifications (rule, issue_id, recipient, sent_at) VALUES (?, ?, ?, ?)",
+                                [(rule, issue_id, recipient, now) for rule, issue_id, recipient in keys])
+            self.db.commit()
+
+    # The issue does not offend the rule anymore, so it is notified right away if it offends again
+    def clear(self, rule: str, issue_id: str):
+        if issue_id:
+            self.compliant.setdefault(rule, set()).add(issue_id)
+
+    # offending holds the (rule, issue ID) pairs found in this run, an issue with a compliant item in one project
+    # and an offending item in another still offends, so it is kept
+    def flush_compliant(self, offending: set = frozenset()):
+        with self.lock:
+            for rule, issue_ids in self.compliant.items():
+                self.db.executemany("DELETE FROM notifications WHERE rule = ? AND issue_id = ?",
+                                    [(rule, issue_id) for issue_id in issue_ids if (rule, issue_id) not in offending])
+            self.db.commit()
+        self.compliant = {}
+
+ledger = NotificationLedger(os.path.join(get_cache_dir(), 'notifications.sqlite3'))
@@ -0,0 +1,143 @@
+#This script turns the project items of the GraphQL response into compact ProjectItem objects that all rules read.
+import re
+import sys
+from enum import Enum
+from datetime import date
+
+# Aliases of the fieldValueByName lookups of a slim crawl, see github_utils.get_field_values_selection
+FIELD_ALIASES = ('dueDate', 'status', 'domain')
+
+NON_WORD = re.compile(r'\W+')
+DONE = re.compile(r'\bdone\b', re.IGNORECASE)
+
+class Status(Enum):
+    NONE = 0
+    OPEN = 1
+    DONE = 2
+
+class ProjectItem:
+    __slots__ = ('item_id', 'issue_id', 'repository_id', 'author_id', 'owner', 'repo', 'number', 'title',
+                 'author_login', 'labels', 'due_date', 'status', 'has_domain')
+
+    def __init__(self, item_id, issue_id, repository_id, author_id, owner, repo, number, title,
+                 author_login, labels, due_date, status, has_domain):
+        self.item_id = item_id
+        self.issue_id = issue_id
+        self.repository_id = repository_id
+        self.author_id = author_id
+        self.owner = owner
+        self.repo = repo
+        self.number = number
+        self.title = title
+        self.author_login = author_login
+        self.labels = labels
+        self.due_date = due_date
+        self.status = status
+        self.has_domain = has_domain
+
+    @property
+    def is_done(self) -> bool:
+        return self.status is Status.DONE
+
+    def __repr__(self):
+        return f"ProjectItem({self.owner}/{self.repo}#{self.number})"
+
+# Field names, status names, dates and repositories repeat across items, so each distinct value is worked out only once
+field_kinds = {}
+statuses = {}
+dates = {}
+repositories = {}
+
+def field_kind(field_name: str) -> str:
+    kind = field_kinds.get(field_name)
+    if kind is None:
+        sanitized = NON_WORD.sub('', field_name)
+        if sanitized == "DueDate":
+            kind = 'due_date'
+        elif sanitized == "Status":
+            kind = 'status'
+        elif field_name == "Domain":
+            kind = 'domain'
+        else:
+            kind = ''
+        field_kinds[field_name] = kind
+    return kind
+
+def status_of(status_name: str) -> Status:
+    status = statuses.get(status_name)
+    if status is None:
+        status = Status.DONE if DONE.search(NON_WORD.sub('', status_name)) else Status.OPEN
+        statuses[status_name] = status
+    return status
+
+def date_of(value: str) -> date:
+    parsed = dates.get(value)
+    if parsed is None:
+        parsed = dates[value] = date.fromisoformat(value)
+    return parsed
+
+def repository_of(name_with_owner: str) -> tuple:
+    repository = repositories.get(name_with_owner)
+    if repository is None:
+        owner, repo = name_with_owner.split('/')
+        repository = repositories[name_with_owner] = (sys.intern(owner), sys.intern(repo))
+    return repository
+
+# Build a ProjectItem from a project item node, returns None if the item is not an issue
+# With the field schema of the project, fields are matched by ID and Done by option ID instead of by name
+def decode_item(node: dict, schema=None) -> ProjectItem:
+    content = node.get('content')
+    if not content or 'number' not in content or 'title' not in content:
+        return None
+
+    repository = content['repository']
+    owner, repo = repository_of(repository['nameWithOwner'])
+    author = content.get('author') or {}
+    due_date = None
+    status = Status.NONE
+    has_domain = False
+
+    # Slim crawls look fields up by name under an alias instead of listing the field values
+    if 'fieldValues' in node:
+        field_values = node['fieldValues']['nodes']
+    else:
+        field_values = [node[alias] for alias in FIELD_ALIASES if node.get(alias)]
+
+    for field in field_values:
+        field_info = field.get('field')
+        if not field_info:
+            continue
+        if schema is not None:
+            kind = schema.kinds.get(field_info.get('id'))
+        else:
+            kind = field_kind(field_info.get('name', ''))
+        if kind == 'due_date':
+            if field.get('date'):
+                due_date = date_of(field['date'])
+        elif kind == 'status':
+            if schema is not None:
+                status = Status.DONE if field.get('optionId') in schema.done_option_ids else Status.OPEN
+            else:
+                status = status_of(field.get('name', ''))
+        elif kind == 'domain':
+            has_domain = True
+
+    return ProjectItem(
+        node.get('id'),
+        content.get('id'),
+        repository.get('id'),
+        author.get('id'),
+        owner,
+        repo,
+        content['number'],
+        content['title'],
+        author.get('login', 'Unknown'),
+        frozenset(label['name'] for label in (content.get('labels') or {}).get('nodes', ())),
+        due_date,
+        status,
+        has_domain
+    )
+
+def decode_items(nodes: list, schema=None) -> list:
+    items = (decode_item(node, schema) for node in nodes)
+    return [item for item in items if item is not None]
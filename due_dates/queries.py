@@ -0,0 +1,53 @@
+#This script keeps a registry of named GraphQL documents, each one is minified and serialized once and then only the variables change between requests.
+import os
+import re
+import json
+import hashlib
+
+# Send only the sha256 of a registered document (persisted queries), for backends that support it
+PERSISTED_QUERIES = os.environ.get('PERSISTED_QUERIES', '') == '1'
+
+# Strings are kept as they are, everything else is split into names and punctuation
+TOKEN = re.compile(r'"(?:\\.|[^"\\])*"|\.\.\.|[A-Za-z0-9_$]+|[^\sA-Za-z0-9_$,]')
+
+def minify(document: str) -> str:
+    minified = ""
+    previous = ""
+    for token in TOKEN.findall(re.sub(r'#[^\n]*', '', document)):
+        # Only two names or numbers next to each other need a space between them
+        if previous and (previous[-1].isalnum() or previous[-1] in '_$') and (token[0].isalnum() or token[0] in '_$'):
+            minified += " "
+        minified += token
+        previous = token
+    return minified
+
+class Query:
+    __slots__ = ('name', 'text', 'sha256', 'query_json', 'is_mutation')
+
+    def __init__(self, name: str, document: str):
+        self.name = name
+        self.text = minify(document)
+        self.sha256 = hashlib.sha256(self.text.encode()).hexdigest()
+        self.query_json = json.dumps(self.text)
+        # Mutations are not sent again after a lost answer, see http_client.HttpClient
+        self.is_mutation = self.text.startswith('mutation')
+
+    # The document part of the body is serialized once, only the variables are serialized per request
+    def body(self, variables: dict, persisted: bool = False, include_query: bool = True) -> bytes:
+        parts = []
+        if include_query:
+            parts.append('"query":' + self.query_json)
+        if persisted:
+            parts.append('"extensions":{"persistedQuery":{"version":1,"sha256Hash":"%s"}}' % self.sha256)
+        if variables:
+            parts.append('"variables":' + json.dumps(variables, default=str))
+        return ('{' + ','.join(parts) + '}').encode()
+
+registry = {}
+
+def register(name: str, document: str) -> Query:
+    query = registry[name] = Query(name, document)
+    return query
+
+def get(name: str) -> Query:
+    return registry[name]
@@ -0,0 +1,93 @@
+#This script keeps track of the GitHub GraphQL rate limit and slows the calls down so a run never runs out of budget halfway.
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+
+# Points of the budget that are never spent by the scripts
+RATE_LIMIT_RESERVE = int(os.environ.get('RATE_LIMIT_RESERVE', 100))
+
+class RateLimitGovernor:
+    def __init__(self, reserve: int = RATE_LIMIT_RESERVE):
+        self.reserve = reserve
+        self.limit = None
+        self.remaining = None
+        self.reset_at = None
+        self.calls = 0
+        self.total_cost = 0
+        self.expected_calls = 0
+        self.lock = threading.Lock()
+
+    # Every GraphQL response carries the x-ratelimit-* headers of the graphql bucket
+    def update_from_headers(self, headers):
+        if headers.get('x-ratelimit-resource', 'graphql') != 'graphql' or 'x-ratelimit-remaining' not in headers:
+            return
+        with self.lock:
+            self.remaining = int(headers['x-ratelimit-remaining'])
+            if 'x-ratelimit-limit' in headers:
+                self.limit = int(headers['x-ratelimit-limit'])
+            if 'x-ratelimit-reset' in headers:
+                self.reset_at = float(headers['x-ratelimit-reset'])
+
+    # Queries that ask for rateLimit { cost remaining resetAt } tell the exact cost of the call
+    def update_from_result(self, result: dict):
+        rate_limit = (result.get('data') or {}).get('rateLimit')
+        with self.lock:
+            self.calls += 1
+            self.expected_calls = max(0, self.expected_calls - 1)
+            if not rate_limit:
+                self.total_cost += 1
+                return
+            self.total_cost += rate_limit.get('cost', 1)
+            self.remaining = rate_limit.get('remaining', self.remaining)
+            if rate_limit.get('resetAt'):
+                self.reset_at = datetime.strptime(rate_limit['resetAt'], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).timestamp()
+
+    def average_cost(self) -> float:
+        return self.total_cost / self.calls if self.calls else 1
+
+    # Tell the governor how many calls the rest of the run is going to make, returns whether they fit in the budget
+    def expect(self, calls: int) -> bool:
+        with self.lock:
+            self.expected_calls = calls
+        projected = calls * self.average_cost()
+        if self.remaining is None:
+            return True
+        fits = self.remaining - projected >= self.reserve
+        if not fits:
+            logging.warning(f"Projected cost {projected:.0f} does not fit the remaining rate limit {self.remaining} "
+                            f"with a reserve of {self.reserve}, calls will be paced until the reset")
+        else:
+            logging.debug(f"Projected cost {projected:.0f} fits the remaining rate limit {self.remaining}")
+        return fits
+
+    # How long to wait before the next call
+    def delay(self, cost: float = None) -> float:
+        with self.lock:
+            if self.remaining is None or self.reset_at is None:
+                return 0
+            cost = cost or self.average_cost()
+            until_reset = max(0, self.reset_at - time.time())
+            budget = self.remaining - self.reserve
+            # Out of budget, keep the reserve and wait for the reset instead of failing
+            if budget < cost:
+                return until_reset
+            # Not enough budget for the expected calls, spread the budget evenly until the reset
+            if self.expected_calls * cost > budget:
+                return until_reset / (budget / cost)
+            return 0
+
+    def before_call(self, cost: float = None):
+        wait = self.delay(cost)
+        if wait > 0:
+            logging.info(f"Rate limit remaining {self.remaining}, waiting {wait:.1f} seconds")
+            time.sleep(wait)
+
+    def wait_for_reset(self):
+        if self.reset_at is not None:
+            wait = max(0, self.reset_at - time.time())
+            logging.info(f"Rate limit exhausted, waiting {wait:.1f} seconds for the reset")
+            time.sleep(wait)
+
+governor = RateLimitGovernor()
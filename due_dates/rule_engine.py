@@ -0,0 +1,193 @@
+#This script crawls every open project once and runs all the rules over the crawled issues in a single pass.
+import math
+import logging
+import datetime
+import github_utils
+import async_crawler
+import sync_state
+import rate_limit
+import field_schema
+import label_planner
+from project_item import decode_item
+
+class Rule:
+    # predicate(issue, project) decides if the rule applies to an issue, action(issue, project) is run for the issues it applies to
+    # and finish() is called once after the crawl, e.g. to send the queued mutations
+    # needs is the set of item parts the rule reads (see github_utils.ALL_NEEDS), the crawl only asks for what the active rules need
+    # label is the label the rule manages, without an action the label is planned on the issues the predicate holds for,
+    # and with remove_label it is also planned off the issues it does not hold for (see label_planner.py)
+    # compliant(issue, project) is run for the issues the predicate does not hold for, e.g. to forget sent notifications
+    def __init__(self, name: str, predicate, action=None, finish=None, needs: frozenset = github_utils.ALL_NEEDS,
+                 label=None, remove_label: bool = False, compliant=None):
+        self.name = name
+        self.predicate = predicate
+        self.action = action
+        self.finish = finish
+        self.needs = frozenset(needs)
+        self.label = label
+        self.remove_label = remove_label
+        self.compliant = compliant
+
+    # label can depend on the project, e.g. the project name label
+    def label_name(self, project: dict) -> str:
+        return self.label(project) if callable(self.label) else self.label
+
+# Returns None when the catalog could not be fetched
+def fetch_open_projects(org_name: str, github_token: str) -> list:
+    open_projects = github_utils.fetch_project_catalog(org_name, github_token, open_only=True)
+
+    if open_projects is None:
+        logging.error("The open projects could not be fetched")
+    elif open_projects:
+        logging.debug("Open Projects:")
+        for project in open_projects:
+            logging.debug(f"- Project Number: {project['number']}, Project Name: {project['title']}")
+    else:
+        logging.debug("No open projects found.")
+
+    return open_projects
+
+def evaluate_issue(rules: list, issue: dict, project: dict, matches: dict):
+    for rule in rules:
+        matched = rule.predicate(issue, project)
+        if matched:
+            matches[rule.name] += 1
+        elif rule.compliant is not None:
+            rule.compliant(issue, project)
+        if rule.action is not None:
+            if matched:
+                rule.action(issue, project)
+        elif matched or rule.remove_label:
+            label_planner.planner.want(issue, rule.label_name(project), matched)
+
+# Returns the names of the rules whose finish failed and the issues whose labels could not be changed
+def finish_rules(rules: list, github_token: str, plan: bool = False) -> tuple:
+    failed_rules = []
+    for rule in rules:
+        if rule.finish:
+            # A failing finish, e.g. a Slack outage in the digest, does not cost the labels of the other rules
+            try:
+                rule.finish()
+            except Exception:
+                logging.exception(f"Finishing the rule {rule.name} failed")
+                failed_rules.append(rule.name)
+
+    # The labels wanted by all rules are compared with the crawled labels once every rule has run
+    if plan:
+        label_planner.planner.print_plan()
+        return failed_rules, {}
+    return failed_rules, label_planner.planner.apply(github_token)
+
+# Store the evaluated items whose labels and notifications went out, the others are evaluated again on the next run
+def finish_sync(state: sync_state.SyncState, open_projects: list, today: datetime.date, full_sync: bool, crawled_items: dict,
+                seen_item_ids: dict, failed_numbers: set, failed_rules: list, failed_issues: dict):
+    unsynced = set(failed_numbers)
+    if failed_rules:
+        # A failed finish can have lost the findings of any issue, e.g. a digest that was not sent
+        unsynced.update(crawled_items)
+        crawled_items = {}
+    else:
+        # An issue whose labels could not be changed keeps its project unsynced, so the project is crawled again
+        unsynced.update(number for number, items in crawled_items.items()
+                        if any(issue_id in failed_issues for item, due_date, issue_id in items))
+        crawled_items = {number: [(item, due_date) for item, due_date, issue_id in items if issue_id not in failed_issues]
+                         for number, items in crawled_items.items()}
+    # Only the projects crawled to the end know which of their stored items were removed
+    seen_item_ids = {number: item_ids for number, item_ids in seen_item_ids.items() if number not in failed_numbers}
+    state.finish_run(open_projects, today, full_sync, crawled_items, seen_item_ids, unsynced,
+                     complete=not failed_rules and not failed_issues)
+
+# Run the rules over a few issues that were fetched outside of a crawl, issues is a list of (issue, project)
+def run_rules_on_issues(rules: list, issues: list, github_token: str) -> dict:
+    matches = {rule.name: 0 for rule in rules}
+    for issue, project in issues:
+        evaluate_issue(rules, issue, project, matches)
+    finish_rules(rules, github_token)
+    logging.debug("Rule matches: %s", matches)
+    return matches
+
+# With incremental, projects whose updatedAt did not move are not crawled and only the items that changed
+# or whose due date crossed today are evaluated, a full crawl is still done every FULL_SYNC_INTERVAL_HOURS
+# With plan, only the label rules run and the label changes are printed instead of sent
+# A long running caller can pass its own sync state per job and a recent list of open projects (see daemon.py)
+def run_rules(rules: list, org_name: str, github_token: str, incremental: bool = False, plan: bool = False,
+              state: sync_state.SyncState = None, open_projects: list = None) -> dict:
+    if plan:
+        # A plan writes nothing, not even the incremental state
+        rules = [rule for rule in rules if rule.label is not None]
+        incremental = False
+    # Returns how many issues each rule matched
+    matches = {rule.name: 0 for rule in rules}
+    today = datetime.date.today()
+    state = state or sync_state.state
+
+    if open_projects is None:
+        open_projects = fetch_open_projects(org_name, github_token)
+    if open_projects is None:
+        # Like a failed crawl, nothing is evaluated and the sync state is kept for the next run
+        logging.error("No rule was run, the project catalog is missing")
+        return matches
+    full_sync = not incremental or state.full_sync_due()
+    if full_sync:
+        projects_to_crawl = open_projects
+    else:
+        projects_to_crawl = [project for project in open_projects if state.project_changed(project)]
+    logging.debug(f"Crawling {len(projects_to_crawl)} of {len(open_projects)} open projects, full sync: {full_sync}")
+
+    # The catalog knows how many items each project has, so the cost of the crawl can be projected before it starts
+    item_pages = sum(max(1, math.ceil(project['items']['totalCount'] / 100)) for project in projects_to_crawl)
+    rate_limit.governor.expect(item_pages)
+
+    projects_by_number = {project['number']: project for project in open_projects}
+    crawled_numbers = [project['number'] for project in projects_to_crawl]
+    # The incremental state needs the stored versions and the IDs seen in the crawl, a full run keeps only one page
+    # The evaluated items are kept as (item, due date, issue ID) until the rules have finished, see finish_sync
+    stored_items = {number: state.stored_items(number) for number in crawled_numbers} if incremental else {}
+    seen_item_ids = {number: set() for number in crawled_numbers} if incremental else {}
+    crawled_items = {number: [] for number in crawled_numbers} if incremental else {}
+
+    # Rules run on each page as soon as it arrives, pages of different projects are fetched concurrently
+    def process_page(project_number: int, project_items: list):
+        project = projects_by_number[project_number]
+        schema = field_schema.schema_from_project(project)
+        issues = {item['id']: decode_item(item, schema) for item in project_items}
+
+        if incremental:
+            seen_item_ids[project_number].update(issues)
+            due_dates = {item_id: issue.due_date.isoformat() if issue and issue.due_date else None
+                         for item_id, issue in issues.items()}
+            if not full_sync:
+                project_items = state.changed_items(project_items, stored_items[project_number], today)
+            crawled_items[project_number].extend((item, due_dates[item['id']], issues[item['id']] and issues[item['id']].issue_id)
+                                                 for item in project_items)
+
+        for item in project_items:
+            issue = issues[item['id']]
+            if issue is not None:
+                evaluate_issue(rules, issue, project, matches)
+
+    needs = frozenset().union(*[rule.needs for rule in rules])
+    schemas = {project['number']: field_schema.schema_from_project(project) for project in projects_to_crawl}
+    # Projects whose crawl stopped early keep their stored state, so the next incremental run crawls them again
+    failed_numbers = set()
+    async_crawler.crawl_projects(crawled_numbers, org_name, github_token, on_page=process_page, needs=needs, schemas=schemas,
+                                 failed=failed_numbers)
+
+    for project in open_projects:
+        project_number = project['number']
+        if project_number in crawled_numbers:
+            continue
+
+        schema = field_schema.schema_from_project(project)
+        for item in state.crossed_items(project_number, today):
+            issue = decode_item(item, schema)
+            if issue is not None:
+                evaluate_issue(rules, issue, project, matches)
+
+    failed_rules, failed_issues = finish_rules(rules, github_token, plan)
+
+    if incremental:
+        finish_sync(state, open_projects, today, full_sync, crawled_items, seen_item_ids, failed_numbers, failed_rules, failed_issues)
+
+    logging.debug("Rule matches: %s", matches)
+    return matches
@@ -0,0 +1,36 @@
+#This script runs every due date rule (past due, resolved late, missing due date, missing domain, missing project label) over one crawl of the open projects.
+import argparse
+import github_utils
+import rule_engine
+import label_pastdue
+import label_afterdues
+import inform_dues
+import inform_domains
+import label_projectname
+import columnar
+
+RULES = [
+    label_pastdue.rule,
+    label_afterdues.rule,
+    inform_dues.rule,
+    inform_domains.rule,
+    label_projectname.rule
+]
+
+def main():
+    parser = argparse.ArgumentParser(description="Run all due date rules over one crawl of the open projects.")
+    parser.add_argument('--incremental', action='store_true', help='Only crawl and evaluate what changed since the last run')
+    parser.add_argument('--plan', action='store_true', help='Print the label changes and the projected API calls without writing anything')
+    parser.add_argument('--snapshot', action='store_true', help='Also save a columnar snapshot of the crawl for columnar.py report')
+    args, _ = parser.parse_known_args()
+    # A snapshot holds every issue, so it cannot be taken from an incremental crawl
+    if args.snapshot and args.incremental:
+        parser.error("--snapshot needs a full crawl and cannot be used with --incremental")
+
+    GITHUB_TOKEN = github_utils.github_token
+    ORG_NAME = github_utils.org_name
+    rules = RULES + [columnar.rule] if args.snapshot else RULES
+    rule_engine.run_rules(rules, ORG_NAME, GITHUB_TOKEN, incremental=args.incremental, plan=args.plan)
+
+if __name__ == "__main__":
+    main()
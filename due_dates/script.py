@@ -11,8 +11,14 @@ def get_tokens():
     parser.add_argument('--auth-token', default=os.environ.get('AUTH_TOKEN'), help='Authorization token')
     parser.add_argument('--org-name', default=os.environ.get('ORG_NAME'), help='Organization name')
 
-    # Parse arguments
-    args = parser.parse_args()
+    # Parse arguments, the options of the scripts themselves are left for them to parse
+    args, _ = parser.parse_known_args()
 
     # Return the tokens and the org name
     return args.github_token, args.slack_bot_token, args.auth_token, args.org_name
+
+# Directory for the on-disk caches and state kept between runs
+def get_cache_dir() -> str:
+    cache_dir = os.environ.get('DUE_DATES_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'due_dates'))
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
@@ -0,0 +1,118 @@
+#This script collects the findings of the notifier rules and sends each Slack user one digest message instead of one message per issue.
+import json
+import logging
+import requests
+import http_client
+import metrics
+import github_utils
+import notification_ledger
+
+SLACK_POST_MESSAGE_URL = 'https://slack.com/api/chat.postMessage'
+# Slack rejects messages with more than 50 blocks, longer digests are split into pages
+MAX_BLOCKS = 50
+
+# Title line of each kind of finding in the digest
+SECTION_TITLES = {
+    'missing_due_date': ":alarm_clock: Beep-boop, these issues have no due date:",
+    'missing_domain': ":rotating_light: Heads up, these issues have no 'Domain' field:"
+}
+
+def post_message(channel: str, blocks: list) -> bool:
+    headers = {
+        'Content-Type': 'application/json; charset=utf-8',
+        'Authorization': f'Bearer {github_utils.slack_bot_token}'
+    }
+    payload = {
+        'channel': channel,  # Use the user ID directly
+        'blocks': blocks
+    }
+    # A failed message only costs the digest of that user, the others are still sent
+    try:
+        with metrics.phase('notify'):
+            response = http_client.post(SLACK_POST_MESSAGE_URL, 'slack_post_message', headers=headers, data=json.dumps(payload))
+    except requests.RequestException as error:
+        logging.error(f'Failed to send message to {channel}: {error}')
+        return False
+
+    if response.status_code != 200:
+        logging.error(f'Failed to send message: {response.text}')
+        return False
+    response_data = response.json()
+    if not response_data.get('ok'):
+        logging.error(f"Error: {response_data.get('error')}")
+        return False
+    return True
+
+class Digest:
+    def __init__(self):
+        # Slack user ID -> kind of finding (the rule name) -> issue ID -> (issue url, issue number, title)
+        self.findings = {}
+
+    def add(self, user_id: str, kind: str, issue_id: str, link: str, issuenumber: int, title: str):
+        self.findings.setdefault(user_id, {}).setdefault(kind, {})[issue_id] = (link, issuenumber, title)
+
+    # Drop the findings the user was already notified of within the re-notify interval, checked with one lookup for all of them
+    def drop_recently_sent(self):
+        ledger = notification_ledger.ledger
+        keys = [(kind, issue_id, user_id) for user_id, kinds in self.findings.items()
+                for kind, issues in kinds.items() for issue_id in issues]
+        due_keys = set(ledger.due(keys))
+        for kind, issue_id, user_id in keys:
+            if (kind, issue_id, user_id) not in due_keys:
+                del self.findings[user_id][kind][issue_id]
+        for user_id in list(self.findings):
+            self.findings[user_id] = {kind: issues for kind, issues in self.findings[user_id].items() if issues}
+            if not self.findings[user_id]:
+                del self.findings[user_id]
+
+    def get_blocks(self, user_id: str) -> list:
+        blocks = [{
+            "type": "section",
+            "text": {"type": "mrkdwn", "text": f"Hey <@{user_id}>, some of your issues need a look."}
+        }]
+        # Sorted so the digest and its pages do not depend on the order the crawled pages arrived in
+        for kind, issues in sorted(self.findings[user_id].items()):
+            blocks.append({"type": "divider"})
+            blocks.append({
+                "type": "section",
+                "text": {"type": "mrkdwn", "text": SECTION_TITLES.get(kind, kind)}
+            })
+            for issue_id, (link, issuenumber, title) in sorted(issues.items()):
+                blocks.append({
+                    "type": "section",
+                    "text": {"type": "mrkdwn", "text": f"• #{issuenumber} <{link}|{title}>"}
+                })
+        return blocks
+
+    # Split the blocks into messages of at most MAX_BLOCKS, each page after the first one gets a page header
+    def get_pages(self, user_id: str) -> list:
+        blocks = self.get_blocks(user_id)
+        if len(blocks) <= MAX_BLOCKS:
+            return [blocks]
+        page_size = MAX_BLOCKS - 1
+        chunks = [blocks[i:i + page_size] for i in range(0, len(blocks), page_size)]
+        return [[{
+            "type": "context",
+            "elements": [{"type": "mrkdwn", "text": f"Page {number} of {len(chunks)}"}]
+        }] + chunk for number, chunk in enumerate(chunks, 1)]
+
+    # Send one digest to every user with findings, returns the number of messages sent
+    # A finding is recorded in the notification ledger once every page of the digest was sent
+    def flush(self) -> int:
+        ledger = notification_ledger.ledger
+        ledger.flush_compliant({(kind, issue_id) for kinds in self.findings.values() for kind, issues in kinds.items() for issue_id in issues})
+        self.drop_recently_sent()
+        sent = 0
+        for user_id in sorted(self.findings):
+            pages = self.get_pages(user_id)
+            sent_pages = sum(1 for blocks in pages if post_message(user_id, blocks))
+            if sent_pages == len(pages):
+                ledger.record([(kind, issue_id, user_id) for kind, issues in self.findings[user_id].items() for issue_id in issues])
+            sent += sent_pages
+            del self.findings[user_id]
+        if sent:
+            logging.debug(f"Sent {sent} digest messages")
+        return sent
+
+# Findings of all notifier rules are collected here and sent after the crawl
+digest = Digest()
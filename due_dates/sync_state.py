@@ -0,0 +1,115 @@
+#This script remembers what the last run has seen, so an incremental run only crawls the projects and evaluates the items that changed since then.
+import os
+import json
+import time
+import sqlite3
+import logging
+import datetime
+import threading
+from script import get_cache_dir
+
+# A full crawl is forced when the last one is older than this many hours
+FULL_SYNC_INTERVAL = float(os.environ.get('FULL_SYNC_INTERVAL_HOURS', 24)) * 60 * 60
+
+# The item and its issue both have an updatedAt, a change in either means the item has to be evaluated again
+def item_version(item: dict) -> str:
+    content = item.get('content') or {}
+    return f"{item.get('updatedAt')}|{content.get('updatedAt')}"
+
+class SyncState:
+    def __init__(self, path: str, full_sync_interval: float = FULL_SYNC_INTERVAL):
+        self.full_sync_interval = full_sync_interval
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS projects (number INTEGER PRIMARY KEY, updated_at TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS items (item_id TEXT PRIMARY KEY, project_number INTEGER, version TEXT, due_date TEXT, data TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS items_project ON items (project_number)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY CHECK (id = 0), last_run_date TEXT, last_full_sync REAL)")
+        self.db.commit()
+
+    def _last_run(self):
+        row = self.db.execute("SELECT last_run_date, last_full_sync FROM runs WHERE id = 0").fetchone()
+        return row if row else (None, None)
+
+    def full_sync_due(self) -> bool:
+        last_run_date, last_full_sync = self._last_run()
+        return last_run_date is None or last_full_sync is None or time.time() - last_full_sync >= self.full_sync_interval
+
+    def project_changed(self, project: dict) -> bool:
+        row = self.db.execute("SELECT updated_at FROM projects WHERE number = ?", (project['number'],)).fetchone()
+        return row is None or row[0] != project.get('updatedAt')
+
+    # Due dates that were not past at the last run but are past today, these items change state without being updated
+    @staticmethod
+    def _crossed_due_date(due_date: str, last_run_date: str, today: str) -> bool:
+        if due_date is None or last_run_date is None:
+            return False
+        return last_run_date <= due_date < today
+
+    # Version and due date of the stored items of a project, keyed by item ID
+    def stored_items(self, project_number: int) -> dict:
+        return {row[0]: (row[1], row[2]) for row in self.db.execute(
+            "SELECT item_id, version, due_date FROM items WHERE project_number = ?", (project_number,))}
+
+    # Items of a crawled page that changed since the last run or whose due date crossed today
+    def changed_items(self, project_items: list, stored: dict, today: datetime.date) -> list:
+        changed = []
+        # The last run date is read once per page, not once per item
+        last_run_date = self._last_run()[0]
+        today = today.isoformat()
+        for item in project_items:
+            previous = stored.get(item['id'])
+            if previous is None or previous[0] != item_version(item) or self._crossed_due_date(previous[1], last_run_date, today):
+                changed.append(item)
+        return changed
+
+    # Items of a project that was not crawled but whose due date crossed today, taken from the stored copies
+    def crossed_items(self, project_number: int, today: datetime.date) -> list:
+        last_run_date = self._last_run()[0]
+        if last_run_date is None:
+            return []
+        rows = self.db.execute(
+            "SELECT data FROM items WHERE project_number = ? AND due_date >= ? AND due_date < ?",
+            (project_number, last_run_date, today.isoformat()))
+        return [json.loads(row[0]) for row in rows]
+
+    # items are (item, due date) pairs, the caller holds the lock
+    def _save_items(self, project_number: int, items: list):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO items (item_id, project_number, version, due_date, data) VALUES (?, ?, ?, ?, ?)",
+            [(item['id'], project_number, item_version(item), due_date, json.dumps(item)) for item, due_date in items])
+
+    # Drop the stored items that were not seen in the crawl of the project, they were removed from it
+    def _drop_missing_items(self, project_number: int, seen_item_ids: set):
+        missing = [item_id for item_id in self.stored_items(project_number) if item_id not in seen_item_ids]
+        self.db.executemany("DELETE FROM items WHERE item_id = ?", [(item_id,) for item_id in missing])
+
+    # Everything is written once the rules have finished, so an item whose labels or notifications did not go out
+    # is not stored and is evaluated again on the next run
+    # crawled_items are the (item, due date) pairs to store per project and seen_item_ids the IDs of the fully crawled projects
+    # The projects in failed_numbers are not synced, their updatedAt is not saved so they are crawled again,
+    # and without complete or with failed projects the run neither counts as a full sync nor moves the last run date,
+    # so no crossed due date is missed
+    def finish_run(self, projects: list, today: datetime.date, full_sync: bool, crawled_items: dict, seen_item_ids: dict,
+                   failed_numbers: set = frozenset(), complete: bool = True):
+        synced = complete and not failed_numbers
+        with self.lock:
+            for project_number, items in crawled_items.items():
+                self._save_items(project_number, items)
+            for project_number, item_ids in seen_item_ids.items():
+                self._drop_missing_items(project_number, item_ids)
+            self.db.executemany("INSERT OR REPLACE INTO projects (number, updated_at) VALUES (?, ?)",
+                                [(project['number'], project.get('updatedAt')) for project in projects
+                                 if project['number'] not in failed_numbers])
+            if synced:
+                last_full_sync = time.time() if full_sync else self._last_run()[1]
+                self.db.execute("INSERT OR REPLACE INTO runs (id, last_run_date, last_full_sync) VALUES (0, ?, ?)",
+                                (today.isoformat(), last_full_sync))
+            self.db.commit()
+        if failed_numbers:
+            logging.error(f"Projects {sorted(failed_numbers)} were not synced, they are crawled again on the next run")
+        if not synced:
+            logging.error("The run was not complete, the next run evaluates the due dates crossed since the last complete run")
+        logging.debug(f"Saved sync state for {len(projects) - len(failed_numbers)} projects, full sync: {full_sync and synced}")
+
+state = SyncState(os.path.join(get_cache_dir(), 'sync_state.sqlite3'))
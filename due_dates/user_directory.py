@@ -0,0 +1,114 @@
+#This script keeps the Otsimo user list as a GitHub login -> Slack user ID index, saved on disk and refreshed with a conditional request once it gets old.
+import os
+import json
+import time
+import logging
+import requests
+import http_client
+import metrics
+import github_utils
+from script import get_cache_dir
+
+OTSIMO_USERS_URL = 'https://apis.otsimo.com/api/v1/yoshi/listusers'
+
+# How long the saved directory is used before asking Otsimo whether it changed
+USER_DIRECTORY_TTL_HOURS = float(os.environ.get('USER_DIRECTORY_TTL_HOURS', 24))
+# After a failed refresh, the saved (or empty) directory is used for this long before asking again
+USER_DIRECTORY_RETRY_MINUTES = float(os.environ.get('USER_DIRECTORY_RETRY_MINUTES', 10))
+
+class UserDirectory:
+    def __init__(self, path: str, ttl_hours: float = USER_DIRECTORY_TTL_HOURS, retry_minutes: float = USER_DIRECTORY_RETRY_MINUTES):
+        self.path = path
+        self.ttl = ttl_hours * 3600
+        self.retry_delay = retry_minutes * 60
+        self.retry_at = 0
+        # Lower-cased githubName -> slackUserId
+        self.index = None
+        self.etag = None
+        self.last_modified = None
+        self.fetched_at = 0
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.index = saved['index']
+        self.etag = saved.get('etag')
+        self.last_modified = saved.get('last_modified')
+        self.fetched_at = saved.get('fetched_at', 0)
+
+    def write(self):
+        saved = {
+            'index': self.index,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'fetched_at': self.fetched_at
+        }
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(saved, f)
+        os.replace(self.path + '.tmp', self.path)
+
+    @staticmethod
+    def build_index(users: list) -> dict:
+        index = {}
+        for user in users:
+            if user.get('githubName') and user.get('slackUserId'):
+                index[user['githubName'].lower()] = user['slackUserId']
+        return index
+
+    # Ask Otsimo for the user list, a 304 answer means the saved index is still right
+    def refresh(self, auth_token: str):
+        headers = {
+            "Authorization": auth_token
+        }
+        if self.index is not None:
+            if self.etag:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified:
+                headers['If-Modified-Since'] = self.last_modified
+
+        try:
+            with metrics.phase('notify'):
+                response = http_client.get(OTSIMO_USERS_URL, 'otsimo_listusers', headers=headers)
+            if response.status_code == 304 and self.index is not None:
+                logging.debug("Otsimo users did not change")
+            elif response.status_code == 200:
+                index = self.build_index(response.json()['users'])
+                self.index = index
+                self.etag = response.headers.get('ETag')
+                self.last_modified = response.headers.get('Last-Modified')
+                logging.debug(f"Fetched {len(self.index)} Otsimo users")
+            else:
+                raise requests.HTTPError(f"{response.status_code}, {response.text}")
+        except (requests.RequestException, ValueError, KeyError, TypeError) as error:
+            # Better to notify with a day old directory than not at all, and an outage must not stop the crawl
+            if self.index is not None:
+                logging.error(f"Could not refresh the Otsimo users, using the saved list: {error}")
+            else:
+                logging.error(f"Could not fetch the Otsimo users: {error}")
+                self.index = {}
+            self.retry_at = time.time() + self.retry_delay
+            return
+
+        self.fetched_at = time.time()
+        self.write()
+
+    # The directory is loaded once per process, from disk while it is fresh
+    def load(self, auth_token: str) -> dict:
+        if self.index is not None and (time.time() - self.fetched_at < self.ttl or time.time() < self.retry_at):
+            return self.index
+        if self.index is None:
+            self.read()
+        if self.index is None or time.time() - self.fetched_at >= self.ttl:
+            self.refresh(auth_token)
+        return self.index
+
+    def slack_user_id(self, github_login: str) -> str:
+        if not github_login:
+            return None
+        return self.load(github_utils.auth_token).get(github_login.lower())
+
+# Shared by all notifier rules
+directory = UserDirectory(os.path.join(get_cache_dir(), 'users.json'))
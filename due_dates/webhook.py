@@ -0,0 +1,183 @@
+#This script receives the GitHub projects_v2_item and issues webhooks and runs the due date rules over only the items the events are about.
+import os
+import hmac
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import github_utils
+import rule_engine
+import field_schema
+import run_all
+from daemon import ProjectSnapshot
+from project_item import decode_item
+
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+WEBHOOK_HOST = os.environ.get('WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', 8080))
+# Events on the same item within this many seconds are handled once, e.g. a status and a due date edit in one go
+WEBHOOK_DEBOUNCE_SECONDS = float(os.environ.get('WEBHOOK_DEBOUNCE_SECONDS', 5))
+# Login of the account the rules write labels with, the issue events it causes need no evaluation
+WEBHOOK_BOT_LOGIN = os.environ.get('WEBHOOK_BOT_LOGIN', '')
+
+def verify_signature(secret: str, body: bytes, signature: str) -> bool:
+    if not secret or not signature:
+        return False
+    expected = 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+# Labels with a fixed name that the rules add and remove themselves, e.g. 'Past Due'
+def managed_labels(rules: list) -> frozenset:
+    return frozenset(rule.label for rule in rules if isinstance(rule.label, str))
+
+# The node the event is about, as (node ID, whether it is an issue), None for the events that need no evaluation
+# Label events of the managed labels or sent by the bot are mostly the echo of our own label batches,
+# evaluating them would cost a query per labeled issue
+def affected_node(event: str, payload: dict, ignored_labels: frozenset = frozenset(), bot_login: str = ''):
+    if event == 'projects_v2_item':
+        item = payload.get('projects_v2_item') or {}
+        if payload.get('action') in ('deleted', 'archived') or item.get('content_type') not in (None, 'Issue'):
+            return None
+        return (item['node_id'], False) if item.get('node_id') else None
+    if event == 'issues':
+        if payload.get('action') in ('labeled', 'unlabeled'):
+            sender = (payload.get('sender') or {}).get('login')
+            if (payload.get('label') or {}).get('name') in ignored_labels or (bot_login and sender == bot_login):
+                return None
+        issue = payload.get('issue') or {}
+        return (issue['node_id'], True) if issue.get('node_id') else None
+    return None
+
+class Debouncer:
+    # Collects the affected nodes and hands each one to handle(node_id, is_issue) once it had no event for delay seconds
+    def __init__(self, handle, delay: float = WEBHOOK_DEBOUNCE_SECONDS):
+        self.handle = handle
+        self.delay = delay
+        self.pending = {}
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.worker = threading.Thread(target=self.run, daemon=True)
+
+    def add(self, node_id: str, is_issue: bool):
+        with self.condition:
+            self.pending[node_id] = (time.time() + self.delay, is_issue)
+            self.condition.notify()
+
+    # Wait until some nodes are due, returns None once the debouncer is stopped and nothing is left
+    def next_due(self) -> list:
+        with self.condition:
+            while True:
+                now = time.time()
+                due = [node_id for node_id, (deadline, _) in self.pending.items() if self.stopped or deadline <= now]
+                if due:
+                    return [(node_id, self.pending.pop(node_id)[1]) for node_id in due]
+                if self.stopped:
+                    return None
+                timeout = min(deadline for deadline, _ in self.pending.values()) - now if self.pending else None
+                self.condition.wait(timeout)
+
+    # One worker handles the nodes one after another, the rules share the label planner and the digest
+    def run(self):
+        while True:
+            due = self.next_due()
+            if due is None:
+                return
+            for node_id, is_issue in due:
+                try:
+                    self.handle(node_id, is_issue)
+                except Exception:
+                    logging.exception(f"Could not evaluate {node_id}")
+
+    def start(self):
+        self.worker.start()
+
+    # Pending nodes are handled right away before stopping
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.worker.join()
+
+class ItemEvaluator:
+    def __init__(self, rules: list, org_name: str, github_token: str):
+        self.rules = rules
+        self.org_name = org_name
+        self.github_token = github_token
+        self.snapshot = ProjectSnapshot()
+
+    # Fetch the project items of the node again and run the rules over the ones in open projects
+    def evaluate(self, node_id: str, is_issue: bool) -> dict:
+        projects = {project['number']: project for project in self.snapshot.get(self.org_name, self.github_token) or []}
+        issues = []
+        for node in github_utils.fetch_items_of_node(node_id, self.github_token, is_issue):
+            project = projects.get(node['project']['number'])
+            if project is None:
+                continue
+            issue = decode_item(node, field_schema.schema_from_project(project))
+            if issue is not None:
+                issues.append((issue, project))
+
+        matches = rule_engine.run_rules_on_issues(self.rules, issues, self.github_token)
+        logging.info(f"Evaluated {len(issues)} items of {node_id}: {matches}")
+        return matches
+
+def make_handler(secret: str, debouncer: Debouncer, ignored_labels: frozenset = frozenset(), bot_login: str = WEBHOOK_BOT_LOGIN):
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if not verify_signature(secret, body, self.headers.get('X-Hub-Signature-256')):
+                logging.error("Webhook with a wrong signature was rejected")
+                self.send_response(401)
+                self.end_headers()
+                return
+
+            event = self.headers.get('X-GitHub-Event', '')
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                self.send_response(400)
+                self.end_headers()
+                return
+
+            node = affected_node(event, payload, ignored_labels, bot_login)
+            if node is not None:
+                debouncer.add(*node)
+            logging.debug(f"Webhook {event} {payload.get('action')}: {node}")
+            # GitHub only waits 10 seconds for an answer, the item is evaluated after the response
+            self.send_response(202 if node is not None else 204)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            logging.debug("Webhook request: " + format % args)
+
+    return WebhookHandler
+
+def serve(host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT, secret: str = WEBHOOK_SECRET, rules: list = None):
+    if not secret:
+        raise ValueError("No WEBHOOK_SECRET found in environment variables")
+    rules = rules or run_all.RULES
+    evaluator = ItemEvaluator(rules, github_utils.org_name, github_utils.github_token)
+    debouncer = Debouncer(evaluator.evaluate)
+    server = ThreadingHTTPServer((host, port), make_handler(secret, debouncer, managed_labels(rules)))
+    debouncer.start()
+    logging.info(f"Listening for webhooks on {host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        debouncer.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Receive GitHub webhooks and evaluate the due date rules for the changed items.")
+    parser.add_argument('--host', default=WEBHOOK_HOST, help='Address to listen on')
+    parser.add_argument('--port', type=int, default=WEBHOOK_PORT, help='Port to listen on')
+    args, _ = parser.parse_known_args()
+    serve(args.host, args.port)
+
+if __name__ == "__main__":
+    main()
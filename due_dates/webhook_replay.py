@@ -0,0 +1,48 @@
+#This script stands in for GitHub and posts recorded webhook payloads, signed with WEBHOOK_SECRET, to a running webhook receiver.
+import os
+import sys
+import hmac
+import json
+import time
+import hashlib
+import argparse
+import requests
+
+def sign(secret: str, body: bytes) -> str:
+    return 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+# A recorded payload file holds {"event": <X-GitHub-Event>, "payload": <webhook body>}
+def replay(url: str, secret: str, paths: list, repeat: int = 1, interval: float = 0.0) -> list:
+    statuses = []
+    for path in paths:
+        with open(path) as f:
+            recorded = json.load(f)
+        body = json.dumps(recorded['payload']).encode()
+        headers = {
+            'Content-Type': 'application/json',
+            'X-GitHub-Event': recorded['event'],
+            'X-GitHub-Delivery': f"replay-{os.path.basename(path)}",
+            'X-Hub-Signature-256': sign(secret, body)
+        }
+        # Repeating a payload imitates a burst of events on one item
+        for _ in range(repeat):
+            response = requests.post(url, data=body, headers=headers, timeout=10)
+            statuses.append(response.status_code)
+            print(f"{path}: {response.status_code}")
+            time.sleep(interval)
+    return statuses
+
+def main():
+    parser = argparse.ArgumentParser(description="Post recorded GitHub webhook payloads to the webhook receiver.")
+    parser.add_argument('paths', nargs='+', help='Recorded payload files, see webhook_payloads/')
+    parser.add_argument('--url', default=f"http://127.0.0.1:{os.environ.get('WEBHOOK_PORT', 8080)}/", help='URL of the receiver')
+    parser.add_argument('--secret', default=os.environ.get('WEBHOOK_SECRET', ''), help='Webhook secret to sign the payloads with')
+    parser.add_argument('--repeat', type=int, default=1, help='How many times each payload is posted')
+    parser.add_argument('--interval', type=float, default=0.0, help='Seconds between two posts')
+    args = parser.parse_args()
+
+    statuses = replay(args.url, args.secret, args.paths, args.repeat, args.interval)
+    sys.exit(0 if all(status < 300 for status in statuses) else 1)
+
+if __name__ == "__main__":
+    main()
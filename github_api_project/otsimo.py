@@ -1,6 +1,12 @@
-import requests
-from github import Github
+import os
 import sys
+from github import Github
+# Shared pooled HTTP client lives next to the due date scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'due_dates'))
+import http_client
+import metrics
+# Kept apart from the metrics of the due date scripts that share METRICS_DIR
+metrics.run_name = 'otsimo'
 from gql import GraphQLRequest
 from gql import Client
 
@@ -22,11 +28,16 @@ except Exception as e:
 #Function to check rate limit so program stops if rate limit is already reached
 def check_rate_limit(token):
     headers = {"Authorization": f"token {token}"}
-    response = requests.get("https://api.github.com/rate_limit", headers=headers)
+    response = http_client.get("https://api.github.com/rate_limit", headers=headers)
     if response.status_code == 200:
-        rate_limit_info = (response.json())['resources']['core']['remaining']
+        resources = (response.json())['resources']
+        rate_limit_info = resources['core']['remaining']
         if rate_limit_info <=0:
             print("Rate limit reached.")
+        #Issues are added to projects over GraphQL, which has its own bucket
+        graphql_rate_limit_info = resources['graphql']['remaining']
+        if graphql_rate_limit_info <=0:
+            print("GraphQL rate limit reached.")
     else:
         print("Failed to fetch rate limit status.")
         sys.exit()
@@ -44,7 +55,7 @@ def create_github_repo(token, repo_name, repo_description):
         "description": repo_description,
         "private": False,
     }
-    response = requests.post("https://api.github.com/user/repos", headers=headers, json=data)
+    response = http_client.post("https://api.github.com/user/repos", headers=headers, json=data)
     if response.status_code == 201:
         print(f"Repository '{repo_name}' created successfully.")
         return response.json()
@@ -60,7 +71,7 @@ def get_repository_id(token, owner, repo_name):
         'Authorization': 'Bearer ' + token,
     }
 
-    response = requests.get(endpoint, headers=headers)
+    response = http_client.get(endpoint, headers=headers)
 
     if response.status_code == 200:
         data = response.json()
@@ -95,7 +106,7 @@ def get_issue_node_id(token, owner, repo_name, issue_number):
         "Content-Type": "application/json"
     }
     
-    response = requests.post(endpoint, json={'query': query, 'variables': variables}, headers=headers)
+    response = http_client.post(endpoint, json={'query': query, 'variables': variables}, headers=headers)
 
     if response.status_code == 200:
         data = response.json()
@@ -121,7 +132,7 @@ def get_project_node_ids(owner, repo_name, token):
     """
     variables = {"owner": owner, "repoName": repo_name}
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    response = requests.post('https://api.github.com/graphql', json={'query': query, 'variables': variables}, headers=headers)
+    response = http_client.post('https://api.github.com/graphql', json={'query': query, 'variables': variables}, headers=headers)
     
      #fetching project names and node IDs in a list
     project_node_ids = []
@@ -156,7 +167,7 @@ def add_issue_to_project(token, project_node_id, issue_node_id):
         "Content-Type": "application/json"
     }
     
-    response = requests.post('https://api.github.com/graphql', json={'query': mutation, 'variables': variables}, headers=headers)
+    response = http_client.post('https://api.github.com/graphql', json={'query': mutation, 'variables': variables}, headers=headers)
     
     if response.status_code == 200:
         print("Issue successfully added to the project.")
@@ -171,7 +182,7 @@ def get_all_issues(token, owner, repo):
     headers = {'Authorization': f'token {token}'}
     all_issues = []
     while issues_url:
-        response = requests.get(issues_url, headers=headers)
+        response = http_client.get(issues_url, headers=headers)
         issues = response.json()
         all_issues.extend(issues)
         if 'next' in response.links:
@@ -197,7 +208,7 @@ def get_all_issues(token, owner, repo):
         'body': project_description
     }
 
-    response = requests.post(url, json=payload, headers=headers)
+    response = http_client.post(url, json=payload, headers=headers)
     if response.status_code == 201:
         print(f"Project '{project_name}' created successfully.")
         return response.json()
@@ -217,7 +228,7 @@ def get_all_issues(token, owner, repo):
     'body': description_new
     }
 
-    response = requests.post(url, json=payload, headers=headers)
+    response = http_client.post(url, json=payload, headers=headers)
 
     if response.status_code == 201:
         print(f"Project {project_new_name} created successfully.")
@@ -233,7 +244,7 @@ def graphql_request(query, variables=None, token=""):
         "Content-Type": "application/json",
     }
     payload = {"query": query, "variables": variables}
-    response = requests.post('https://api.github.com/graphql', headers=headers, json=payload)
+    response = http_client.post('https://api.github.com/graphql', headers=headers, json=payload)
     if response.status_code == 200:
         return response.json()
     else: